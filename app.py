@@ -1,26 +1,100 @@
+import threading
 from flask import Flask
 from flask_mail import Mail
 from config import Config
+from utils.profiling import RequestProfiler
+from utils.monitor import MonitorHub
+from utils.deadlines import DeadlineScheduler
+from utils.quiz_store import QuizStore
+from utils.admission import AdmissionControl
+from utils.maintenance import MaintenanceScheduler
+from utils.media import MediaStore
+from utils.backup import BackupScheduler
 
 # Initialize extensions
 mail = Mail()
+profiler = RequestProfiler()
+monitor = MonitorHub()
+deadlines = DeadlineScheduler()
+quiz_store = QuizStore()
+admission = AdmissionControl()
+maintenance = MaintenanceScheduler()
+media_store = MediaStore()
+backups = BackupScheduler()
 
-def create_app():
+# Schedulers and the monitor hub, started once per serving process
+BACKGROUND_SERVICES = (monitor, deadlines, maintenance, backups)
+_background_lock = threading.Lock()
+_background_started = threading.Event()
+
+def start_background_services():
+    """Start background threads if they aren't running yet"""
+    with _background_lock:
+        for service in BACKGROUND_SERVICES:
+            service.start()
+        _background_started.set()
+
+def background_services_started():
+    """Whether this process has started its schedulers and monitor hub"""
+    return _background_started.is_set()
+
+def create_app(start_background=True):
     app = Flask(__name__)
     app.config.from_object(Config)
     
     # Initialize Flask-Mail with app
     mail.init_app(app)
     
+    # Content-addressed image store
+    media_store.init_app(app)
+    
+    # Memory-mapped compiled quizzes shared by all workers
+    quiz_store.init_app(app)
+    
+    # Per-request profiling and slow-request log
+    profiler.init_app(app)
+    
+    # Live exam monitor hub (one per host, shared by all workers)
+    monitor.init_app(app)
+    
+    # Auto-finalize attempts that run out of time
+    deadlines.init_app(app)
+    
+    # Archival, WAL checkpoints and incremental vacuum between exams
+    maintenance.init_app(app)
+    
+    # Periodic online backups with retention
+    backups.init_app(app)
+    
     # Register blueprints
     from routes.main import main
     from routes.quiz import quiz
     from routes.admin import admin
     from routes.support import support
+    from routes.media import media
     
     app.register_blueprint(main)
     app.register_blueprint(quiz)
     app.register_blueprint(admin)
     app.register_blueprint(support)
+    app.register_blueprint(media)
+    
+    # Cap in-flight requests, shedding browsing before exam submissions
+    admission.init_app(app)
+    
+    # Background threads start with the first request this process serves, so
+    # flask CLI commands (which serve none) never run schedulers or bind the monitor port
+    if start_background:
+        started = threading.Event()
+        
+        @app.before_request
+        def start_background_once():
+            if not started.is_set():
+                start_background_services()
+                started.set()
+    
+    # flask CLI maintenance commands
+    from commands import register_commands
+    register_commands(app)
     
     return app
\ No newline at end of file
@@ -0,0 +1,159 @@
+import click
+import os
+import sqlite3
+from models.database import Database
+from utils.dedup import find_duplicates
+from utils.parsers import parse_gift, parse_yaml, validate_questions
+from utils.maintenance import archive_cutoff
+from utils.media import IMAGE_REF
+from utils.backup import DatabaseInUse, list_backups, restore_backup, verify_backup
+
+def register_commands(app):
+    """Register maintenance commands with the flask CLI"""
+
+    @app.cli.command('migrate-answers')
+    @click.option('--batch-size', default=1000, show_default=True, help='Rows converted per transaction')
+    def migrate_answers(batch_size):
+        """Convert stored JSON answers to packed int8 BLOBs"""
+        converted = Database().migrate_answers(batch_size)
+        click.echo(f'Converted {converted} results')
+
+    @app.cli.command('import-pool')
+    @click.argument('name')
+    @click.argument('path', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', 'format_type', type=click.Choice(['yaml', 'gift']), default='yaml', show_default=True)
+    @click.option('--skip-duplicates', is_flag=True, help='Leave out questions that look like duplicates')
+    def import_pool(name, path, format_type, skip_duplicates):
+        """Add questions from a YAML or GIFT file to a question pool"""
+        content = path.read()
+        questions = parse_gift(content) if format_type == 'gift' else parse_yaml(content)
+        valid, error_msg = validate_questions(questions)
+        if not valid:
+            raise click.ClickException(f'Validation error: {error_msg}')
+
+        # Images referenced by relative path are read from next to the file
+        from app import media_store
+        base_dir = os.path.dirname(os.path.abspath(path.name))
+        files = {}
+        for _, src in IMAGE_REF.findall(content):
+            image_path = os.path.join(base_dir, src)
+            if not src.startswith('data:') and os.path.isfile(image_path):
+                with open(image_path, 'rb') as f:
+                    files[os.path.basename(src)] = f.read()
+        try:
+            images = media_store.rewrite_questions(questions, files)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if images:
+            click.echo(f'Stored {images} images')
+
+        db = Database()
+        signatures, duplicates = find_duplicates(db, questions)
+        for index, matches in duplicates:
+            for match in matches:
+                click.echo(f'Q{index + 1} ~ {match["label"]} ({match["similarity"]:.0%})')
+
+        if skip_duplicates and duplicates:
+            skipped = {index for index, _ in duplicates}
+            questions = [q for i, q in enumerate(questions) if i not in skipped]
+            signatures = [s for i, s in enumerate(signatures) if i not in skipped]
+
+        if questions:
+            pool_id, first_position = db.add_pool_questions(name, questions)
+            db.save_question_signatures('pool', pool_id, first_position, signatures)
+        click.echo(f'Added {len(questions)} questions to pool "{name}"')
+
+    @app.cli.command('rebuild-dedup-index')
+    @click.option('--batch-size', default=500, show_default=True, help='Questions indexed per transaction')
+    def rebuild_dedup_index(batch_size):
+        """Compute duplicate-detection signatures for questions that have none"""
+        indexed = Database().index_missing_signatures(batch_size)
+        click.echo(f'Indexed {indexed} questions')
+
+    @app.cli.command('archive-results')
+    @click.option('--days', type=int, default=None, help='Archive rows older than this (default ARCHIVE_AFTER_DAYS)')
+    @click.option('--batch-size', default=500, show_default=True, help='Rows moved per transaction')
+    def archive_results(days, batch_size):
+        """Move old results and read contact messages to the monthly archives"""
+        days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+        moved = Database().archive_old_rows(archive_cutoff(days), batch_size)
+        click.echo(f'Archived {moved["results"]} results and {moved["messages"]} messages, '
+                   f'deleted {moved["attempts"]} finalized attempts')
+
+    @app.cli.command('enable-incremental-vacuum')
+    def enable_incremental_vacuum():
+        """Switch an existing database to auto_vacuum=INCREMENTAL (runs VACUUM; stop the app first)"""
+        if Database().enable_incremental_vacuum():
+            click.echo('Database rewritten with auto_vacuum=INCREMENTAL')
+        else:
+            click.echo('auto_vacuum is already INCREMENTAL')
+
+    @app.cli.command('rebuild-histograms')
+    @click.option('--quiz-id', type=int, default=None, help='Only rebuild this quiz')
+    def rebuild_histograms(quiz_id):
+        """Recount per-quiz score histograms from stored and archived results"""
+        count = Database().rebuild_histograms(quiz_id)
+        click.echo(f'Rebuilt histograms for {count} quizzes')
+
+    @app.cli.command('backup')
+    def backup():
+        """Take an online backup of the database (safe while the app is running)"""
+        from app import backups
+        try:
+            report = backups.backup()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Backed up {report["pages"]} pages to {report["path"]} '
+                   f'({report["size"] // 1024} KB, {report["compressed_size"] // 1024} KB compressed)')
+        click.echo(f'Took {report["duration_seconds"]}s ({report["copy_seconds"]}s copying) in {report["steps"]} steps, '
+                   f'{report["restarts"]} restarts{", finished in one step" if report["single_step"] else ""}')
+        click.echo(f'Longest step {report["longest_step_ms"]}ms; writers waited up to '
+                   f'{report["max_writer_wait_ms"]}ms (average {report["avg_writer_wait_ms"]}ms)')
+        if report['pruned']:
+            click.echo(f'Removed {report["pruned"]} old backups')
+
+    @app.cli.command('restore')
+    @click.argument('path', required=False, type=click.Path(exists=True, dir_okay=False))
+    @click.option('--verify-only', is_flag=True, help='Check the backup without restoring it')
+    @click.option('--yes', is_flag=True, help='Do not ask for confirmation')
+    def restore(path, verify_only, yes):
+        """Verify a backup (default: the newest) and restore it. Stop the app first."""
+        path = path or next(iter(list_backups(app.config['BACKUP_DIR'])), None)
+        if path is None:
+            raise click.ClickException('No backups found')
+
+        if verify_only:
+            try:
+                os.remove(verify_backup(path, app.config['BACKUP_DIR']))
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            click.echo(f'{path} is intact')
+            return
+
+        if not yes:
+            click.confirm(f'Replace {app.config["DATABASE_PATH"]} with {path}?', abort=True)
+        from app import backups, quiz_store, background_services_started
+        if background_services_started():
+            raise click.ClickException('Background schedulers are running in this process; restore from the CLI')
+        db_path = app.config['DATABASE_PATH']
+        try:
+            restored = verify_backup(path, os.path.dirname(os.path.abspath(db_path)))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        try:
+            # The current database is backed up first, so a restore can be undone;
+            # no pruning, which could delete the backup being restored
+            if os.path.exists(db_path):
+                try:
+                    click.echo(f'Saved the current database to {backups.backup(prune=False)["path"]}')
+                except sqlite3.DatabaseError as e:
+                    click.echo(f'Could not back up the current database ({e}); restoring anyway')
+            # The restore needs the only connection to the database, so drop this process's own
+            Database.close_connection()
+            restore_backup(restored, db_path)
+        except DatabaseInUse as e:
+            raise click.ClickException(f'{e}. Stop the app and try again.')
+        finally:
+            os.remove(restored)
+        quiz_store.rebuild(full=True)
+        click.echo(f'Restored {path}')
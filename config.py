@@ -17,6 +17,77 @@ class Config:
     # Quiz settings
     DEFAULT_QUIZ_TIMER = 30  # minutes
     
+    # Compiled quiz store shared by all workers
+    COMPILED_DIR = BASE_DIR / 'compiled'
+    COMPILED_STORE_CHECK_SECONDS = 1
+    
+    # Server-side deadlines
+    DEADLINE_SCHEDULER_ENABLED = os.environ.get('DEADLINE_SCHEDULER_ENABLED', 'True') == 'True'
+    DEADLINE_GRACE_SECONDS = 10  # allowance for network latency on the final submit
+    DEADLINE_BATCH_SIZE = 200  # expired attempts finalized per transaction
+    DEADLINE_SWEEP_SECONDS = 60  # how often to look for attempts nobody scheduled
+    
+    # Profiling and slow-request log
+    PROFILE_DIR = BASE_DIR / 'profiles'
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    PROFILE_SAMPLE_INTERVAL_MS = 5
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    
+    # Live exam monitor (Server-Sent Events on a separate port)
+    MONITOR_ENABLED = os.environ.get('MONITOR_ENABLED', 'True') == 'True'
+    MONITOR_HOST = os.environ.get('MONITOR_HOST', '127.0.0.1')  # 0.0.0.0 to let browsers connect directly
+    MONITOR_PORT = int(os.environ.get('MONITOR_PORT', 5001))
+    MONITOR_PUBLIC_URL = os.environ.get('MONITOR_PUBLIC_URL', '')  # e.g. https://example.com/monitor
+    # Pages allowed to read the stream cross-origin; default: the app's own host
+    MONITOR_ALLOWED_ORIGINS = [o.strip() for o in os.environ.get('MONITOR_ALLOWED_ORIGINS', '').split(',') if o.strip()]
+    MONITOR_COALESCE_MS = 1000
+    MONITOR_TOKEN_MAX_AGE = 12 * 60 * 60  # seconds
+    
+    # Uploaded question images (content-addressed)
+    MEDIA_DIR = BASE_DIR / 'media'
+    MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 5 * 1024 * 1024))
+    MEDIA_THUMBNAIL_SIZE = 480  # px, longest side
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # largest request body (quiz upload with images)
+    
+    # Archival and background database maintenance
+    ARCHIVE_DIR = BASE_DIR / 'archives'
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))  # 0 disables automatic archival
+    ARCHIVE_INTERVAL_HOURS = 24
+    MAINTENANCE_ENABLED = os.environ.get('MAINTENANCE_ENABLED', 'True') == 'True'
+    MAINTENANCE_INTERVAL_SECONDS = 300  # runs only when no attempt is in progress
+    VACUUM_PAGES_PER_RUN = 2000
+    WAL_AUTOCHECKPOINT_PAGES = 10000  # ~40MB, so checkpoints mostly wait for the maintenance job
+    
+    # Online backups (SQLite backup API, copied in small steps while the app runs)
+    BACKUP_DIR = BASE_DIR / 'backups'
+    BACKUP_ENABLED = os.environ.get('BACKUP_ENABLED', 'True') == 'True'
+    BACKUP_INTERVAL_HOURS = int(os.environ.get('BACKUP_INTERVAL_HOURS', 24))
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))  # newest backups kept
+    BACKUP_PAGES_PER_STEP = 256  # ~1MB of 4KB pages per read transaction
+    BACKUP_STEP_SLEEP_MS = 50
+    BACKUP_MAX_RESTARTS = 5  # then the rest is copied in a single step
+    
+    # Request threads per worker process - run_waitress.py and run_production.sh
+    # read this too, so admission control knows how many requests can wait
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+    
+    # Admission control and load shedding (per worker process)
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True') == 'True'
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 6))
+    ADMISSION_RESERVED_SLOTS = 2  # in-flight slots only answer saves and submissions may use
+    # Waiters hold server threads, so the queue is capped at
+    # SERVER_THREADS - ADMISSION_MAX_IN_FLIGHT - 1; set this to cap it lower
+    ADMISSION_MAX_QUEUE = int(os.environ['ADMISSION_MAX_QUEUE']) if os.environ.get('ADMISSION_MAX_QUEUE') else None
+    ADMISSION_QUEUE_SECONDS = 2  # longest a browsing or exam page waits for a slot
+    ADMISSION_CRITICAL_QUEUE_SECONDS = 10  # longest an answer save or submission waits
+    ADMISSION_RETRY_AFTER = 5  # seconds, sent with 503 responses
+    
+    # Per-client token buckets for POSTs: endpoint -> (requests, per seconds)
+    RATE_LIMITS = {
+        'admin.login': (5, 60),
+        'support.contact': (3, 600),
+    }
+    
     # Flask settings
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     
@@ -3,13 +3,26 @@ import json
 from datetime import datetime
 from config import Config
 from contextlib import contextmanager
+from utils.profiling import current_trace, TracedConnection
+from utils.answers import encode_answers, decode_answers
+from utils.search import MARK_START, MARK_END, SEARCH_CANDIDATES, fts_query, highlight_html, encode_cursor
+from utils.dedup import minhash, band_buckets
+from utils.archive import ResultsArchive, archive_row
+from utils.histograms import empty_buckets, percentage_bucket, build_histogram
+from array import array
 import threading
+import time
+
+# sqlite3's default busy timeout, and the longer wait while another process migrates the schema
+BUSY_TIMEOUT_SECONDS = 5
+INIT_LOCK_TIMEOUT_SECONDS = 600
 
 class Database:
     _local = threading.local()
     
     def __init__(self):
         self.db_path = Config.DATABASE_PATH
+        self.archive = ResultsArchive(Config.ARCHIVE_DIR)
         self.init_db()
     
     @contextmanager
@@ -17,26 +30,55 @@ class Database:
         """Get thread-safe database connection with context manager"""
         conn = getattr(self._local, 'connection', None)
         if conn is None:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # Lets the slow-request log see every statement a request runs
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False,
+                                   factory=TracedConnection)
             conn.row_factory = sqlite3.Row
+            # Only takes effect on a new, empty database (see enable_incremental_vacuum)
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
             # Performance optimizations
             conn.execute('PRAGMA journal_mode=WAL')
             conn.execute('PRAGMA synchronous=NORMAL')
             conn.execute('PRAGMA cache_size=-64000')
             conn.execute('PRAGMA temp_store=MEMORY')
+            # Large enough that checkpoints mostly run from the maintenance job
+            conn.execute(f'PRAGMA wal_autocheckpoint={Config.WAL_AUTOCHECKPOINT_PAGES}')
             self._local.connection = conn
         
+        trace = current_trace()
+        started = time.perf_counter()
         try:
             yield conn
             conn.commit()
         except Exception:
             conn.rollback()
             raise
+        finally:
+            if trace is not None:
+                trace.add_phase('db', time.perf_counter() - started)
+    
+    @classmethod
+    def close_connection(cls):
+        """Close this thread's connection; the next get_connection opens a new one"""
+        conn = getattr(cls._local, 'connection', None)
+        if conn is not None:
+            conn.close()
+            cls._local.connection = None
     
     def init_db(self):
-        """Initialize database tables with indexes"""
+        """Initialize database tables with indexes.
+        
+        The schema is checked and migrated in one write transaction, so workers
+        booting together migrate one at a time and the rest find it up to date.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            # A first-deploy migration (e.g. the search backfill) can outlast the usual busy timeout
+            cursor.execute(f'PRAGMA busy_timeout = {INIT_LOCK_TIMEOUT_SECONDS * 1000}')
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'score_histograms'")
+            backfill_histograms = cursor.fetchone() is None
             
             # Quizzes table
             cursor.execute('''
@@ -77,6 +119,71 @@ class Database:
                 )
             ''')
             
+            # Attempts table - server-side record of each quiz sitting
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attempts (
+                    id TEXT PRIMARY KEY,
+                    quiz_id INTEGER NOT NULL,
+                    started_at REAL NOT NULL,
+                    deadline REAL NOT NULL,
+                    answers TEXT NOT NULL DEFAULT '{}',
+                    finalized_at REAL,
+                    result_id INTEGER,
+                    FOREIGN KEY (quiz_id) REFERENCES quizzes (id)
+                )
+            ''')
+            
+            # Question pools - banks that quizzes draw a random subset from
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS question_pools (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pool_questions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pool_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    FOREIGN KEY (pool_id) REFERENCES question_pools (id)
+                )
+            ''')
+            
+            # Per-quiz score distribution, updated with every saved result
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS score_histograms (
+                    quiz_id INTEGER PRIMARY KEY,
+                    results INTEGER NOT NULL DEFAULT 0,
+                    percentage_buckets TEXT NOT NULL,
+                    score_counts TEXT NOT NULL DEFAULT '{}'
+                )
+            ''')
+            
+            # When periodic maintenance tasks last ran - outlives worker processes
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS maintenance_runs (
+                    task TEXT PRIMARY KEY,
+                    last_run REAL NOT NULL
+                )
+            ''')
+            
+            # Columns added after the first release
+            self._add_column(cursor, 'quizzes', 'pool_draws', 'TEXT')
+            self._add_column(cursor, 'quizzes', 'shuffle_questions', 'INTEGER DEFAULT 0')
+            self._add_column(cursor, 'quizzes', 'shuffle_options', 'INTEGER DEFAULT 0')
+            self._add_column(cursor, 'attempts', 'seed', 'INTEGER')
+            self._add_column(cursor, 'attempts', 'current_position', 'INTEGER DEFAULT 0')
+            if self._add_column(cursor, 'results', 'attempt_id', 'TEXT'):
+                # Link results saved by attempts finalized before the column existed
+                cursor.execute('''
+                    UPDATE results SET attempt_id = (SELECT id FROM attempts WHERE result_id = results.id)
+                    WHERE id IN (SELECT result_id FROM attempts WHERE result_id IS NOT NULL)
+                ''')
+            
             # Create indexes
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_results_quiz_id 
@@ -92,18 +199,189 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_contact_messages_created_at 
                 ON contact_messages(created_at DESC)
             ''')
+            
+            # Positions are dense per pool, so sampled questions are point lookups
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_pool_questions_position 
+                ON pool_questions(pool_id, position)
+            ''')
+            
+            # One result per attempt - makes finalization idempotent
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_results_attempt_id 
+                ON results(attempt_id)
+            ''')
+            
+            # Only open attempts are indexed - finalized ones never need a deadline lookup
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attempts_open_deadline 
+                ON attempts(deadline) WHERE finalized_at IS NULL
+            ''')
+            
+            self._init_search(cursor)
+            self._init_dedup(cursor)
+        cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_SECONDS * 1000}')
+        
+        # Count results saved before histograms existed
+        if backfill_histograms:
+            self.rebuild_histograms()
     
-    def create_quiz(self, title, questions, timer_minutes=30):
-        """Create a new quiz"""
+    def _init_search(self, cursor):
+        """Full-text indexes over questions and contact messages, kept in sync by triggers"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('question_fts', 'contact_messages_fts')")
+        existing = {row['name'] for row in cursor.fetchall()}
+        
+        # One row per question, whether it lives in a quiz or a pool
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS question_search (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                owner_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                options TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_question_search_owner 
+            ON question_search(source, owner_id, position)
+        ''')
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS question_fts USING fts5(
+                text, options,
+                content='question_search', content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        ''')
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS contact_messages_fts USING fts5(
+                subject, message, name, email,
+                content='contact_messages', content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        ''')
+        
+        # Options are indexed as one ' | '-separated string per question
+        question_row = '''
+            json_extract({q}, '$.text'),
+            COALESCE((SELECT group_concat(o.value, ' | ') FROM json_each({q}, '$.options') o), '')
+        '''
+        # One statement at a time - executescript would commit the migration transaction
+        for trigger in (
+            '''CREATE TRIGGER IF NOT EXISTS question_search_ai AFTER INSERT ON question_search BEGIN
+                INSERT INTO question_fts (rowid, text, options) VALUES (new.id, new.text, new.options);
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS question_search_ad AFTER DELETE ON question_search BEGIN
+                INSERT INTO question_fts (question_fts, rowid, text, options)
+                VALUES ('delete', old.id, old.text, old.options);
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS quizzes_search_ai AFTER INSERT ON quizzes BEGIN
+                INSERT INTO question_search (source, owner_id, position, text, options)
+                SELECT 'quiz', new.id, q.key, {question_row.format(q='q.value')}
+                FROM json_each(new.questions) q;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS quizzes_search_ad AFTER DELETE ON quizzes BEGIN
+                DELETE FROM question_search WHERE source = 'quiz' AND owner_id = old.id;
+            END''',
+            f'''CREATE TRIGGER IF NOT EXISTS pool_questions_search_ai AFTER INSERT ON pool_questions BEGIN
+                INSERT INTO question_search (source, owner_id, position, text, options)
+                VALUES ('pool', new.pool_id, new.position, {question_row.format(q='new.question')});
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS pool_questions_search_ad AFTER DELETE ON pool_questions BEGIN
+                DELETE FROM question_search
+                WHERE source = 'pool' AND owner_id = old.pool_id AND position = old.position;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS contact_messages_search_ai AFTER INSERT ON contact_messages BEGIN
+                INSERT INTO contact_messages_fts (rowid, subject, message, name, email)
+                VALUES (new.id, new.subject, new.message, new.name, new.email);
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS contact_messages_search_ad AFTER DELETE ON contact_messages BEGIN
+                INSERT INTO contact_messages_fts (contact_messages_fts, rowid, subject, message, name, email)
+                VALUES ('delete', old.id, old.subject, old.message, old.name, old.email);
+            END''',
+        ):
+            cursor.execute(trigger)
+        
+        # Index rows that existed before search was added
+        if 'question_fts' not in existing:
+            cursor.execute(f'''
+                INSERT INTO question_search (source, owner_id, position, text, options)
+                SELECT 'quiz', quizzes.id, q.key, {question_row.format(q='q.value')}
+                FROM quizzes, json_each(quizzes.questions) q
+            ''')
+            cursor.execute(f'''
+                INSERT INTO question_search (source, owner_id, position, text, options)
+                SELECT 'pool', pool_id, position, {question_row.format(q='question')}
+                FROM pool_questions
+            ''')
+        if 'contact_messages_fts' not in existing:
+            cursor.execute("INSERT INTO contact_messages_fts (contact_messages_fts) VALUES ('rebuild')")
+    
+    def _init_dedup(self, cursor):
+        """MinHash signatures and LSH band buckets for near-duplicate detection"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS question_signatures (
+                question_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS question_lsh (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY (band, bucket, question_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_question_lsh_question ON question_lsh(question_id)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS question_search_dedup_ad AFTER DELETE ON question_search BEGIN
+                DELETE FROM question_signatures WHERE question_id = old.id;
+                DELETE FROM question_lsh WHERE question_id = old.id;
+            END
+        ''')
+    
+    def _add_column(self, cursor, table, column, definition):
+        """Add a column to an existing table if it isn't there yet. Returns True if added."""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            return True
+        return False
+    
+    def create_quiz(self, title, questions, timer_minutes=30, pool_draws=None,
+                    shuffle_questions=False, shuffle_options=False):
+        """Create a new quiz.
+        
+        pool_draws is a list of {'pool_id', 'count', 'size'} for quizzes that
+        draw count of the first size questions of each pool per attempt.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
             questions_json = json.dumps(questions)
             cursor.execute(
-                'INSERT INTO quizzes (title, questions, timer_minutes) VALUES (?, ?, ?)',
-                (title, questions_json, timer_minutes)
+                '''INSERT INTO quizzes (title, questions, timer_minutes, pool_draws, shuffle_questions, shuffle_options)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (title, questions_json, timer_minutes, json.dumps(pool_draws) if pool_draws else None,
+                 int(shuffle_questions), int(shuffle_options))
             )
             return cursor.lastrowid
     
+    def _quiz_from_row(self, row):
+        questions = json.loads(row['questions'])
+        pool_draws = json.loads(row['pool_draws']) if row['pool_draws'] else None
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'questions': questions,
+            'question_count': sum(d['count'] for d in pool_draws) if pool_draws else len(questions),
+            'pool_draws': pool_draws,
+            'shuffle_questions': bool(row['shuffle_questions']),
+            'shuffle_options': bool(row['shuffle_options']),
+            'timer_minutes': row['timer_minutes'],
+            'created_at': row['created_at']
+        }
+    
     def get_quiz(self, quiz_id):
         """Get a quiz by ID"""
         with self.get_connection() as conn:
@@ -112,13 +390,7 @@ class Database:
             row = cursor.fetchone()
             
             if row:
-                return {
-                    'id': row['id'],
-                    'title': row['title'],
-                    'questions': json.loads(row['questions']),
-                    'timer_minutes': row['timer_minutes'],
-                    'created_at': row['created_at']
-                }
+                return self._quiz_from_row(row)
             return None
     
     def get_all_quizzes(self):
@@ -128,13 +400,56 @@ class Database:
             cursor.execute('SELECT * FROM quizzes ORDER BY created_at DESC')
             rows = cursor.fetchall()
             
+            return [self._quiz_from_row(row) for row in rows]
+    
+    def get_quiz_versions(self):
+        """{quiz id: created_at} for every quiz - quizzes never change once created"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, created_at FROM quizzes')
+            return {row['id']: row['created_at'] for row in cursor.fetchall()}
+    
+    def get_pools(self):
+        """Get all question pools"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM question_pools ORDER BY name')
             return [{
                 'id': row['id'],
-                'title': row['title'],
-                'questions': json.loads(row['questions']),
-                'timer_minutes': row['timer_minutes'],
+                'name': row['name'],
+                'size': row['size'],
                 'created_at': row['created_at']
-            } for row in rows]
+            } for row in cursor.fetchall()]
+    
+    def add_pool_questions(self, name, questions):
+        """Append questions to a pool, creating it if needed.
+        
+        Returns (pool ID, position of the first added question).
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR IGNORE INTO question_pools (name) VALUES (?)', (name,))
+            cursor.execute('SELECT id, size FROM question_pools WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            pool_id, size = row['id'], row['size']
+            
+            cursor.executemany(
+                'INSERT INTO pool_questions (pool_id, position, question) VALUES (?, ?, ?)',
+                [(pool_id, size + i, json.dumps(q)) for i, q in enumerate(questions)]
+            )
+            cursor.execute('UPDATE question_pools SET size = ? WHERE id = ?', (size + len(questions), pool_id))
+            return pool_id, size
+    
+    def get_pool_questions(self, pool_id, positions):
+        """Get {position: question} for the given positions of a pool"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(positions))
+            cursor.execute(
+                f'SELECT position, question FROM pool_questions WHERE pool_id = ? AND position IN ({placeholders})',
+                [pool_id] + list(positions)
+            )
+            return {row['position']: json.loads(row['question']) for row in cursor.fetchall()}
     
     def delete_quiz(self, quiz_id):
         """Delete a quiz and its results"""
@@ -142,35 +457,407 @@ class Database:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM quizzes WHERE id = ?', (quiz_id,))
             cursor.execute('DELETE FROM results WHERE quiz_id = ?', (quiz_id,))
+            cursor.execute('DELETE FROM score_histograms WHERE quiz_id = ?', (quiz_id,))
+            cursor.execute('DELETE FROM attempts WHERE quiz_id = ?', (quiz_id,))
     
-    def save_result(self, quiz_id, quiz_title, score, total, percentage, answers):
-        """Save quiz result"""
+    def save_result(self, quiz_id, quiz_title, score, total, percentage, answers, attempt_id=None):
+        """Save quiz result. Returns its ID, or the existing result's ID if attempt_id was already saved."""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            answers_json = json.dumps(answers)
             cursor.execute(
-                'INSERT INTO results (quiz_id, quiz_title, score, total, percentage, answers) VALUES (?, ?, ?, ?, ?, ?)',
-                (quiz_id, quiz_title, score, total, percentage, answers_json)
+                '''INSERT INTO results (quiz_id, quiz_title, score, total, percentage, answers, attempt_id)
+                   VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(attempt_id) DO NOTHING''',
+                (quiz_id, quiz_title, score, total, percentage, encode_answers(answers), attempt_id)
             )
-            return cursor.lastrowid
+            if cursor.rowcount == 1:
+                result_id = cursor.lastrowid
+                self._count_result(cursor, quiz_id, score, percentage)
+                return result_id
+            cursor.execute('SELECT id FROM results WHERE attempt_id = ?', (attempt_id,))
+            return cursor.fetchone()['id']
+    
+    def _count_result(self, cursor, quiz_id, score, percentage):
+        """Add a result to its quiz's histogram, in the caller's transaction"""
+        bucket_path = f'$[{percentage_bucket(percentage)}]'
+        score_path = f'$."{int(score)}"'
+        cursor.execute('''
+            INSERT INTO score_histograms (quiz_id, results, percentage_buckets, score_counts)
+            VALUES (?, 1, json_set(?, ?, 1), json_set('{}', ?, 1))
+            ON CONFLICT(quiz_id) DO UPDATE SET
+                results = results + 1,
+                percentage_buckets = json_set(percentage_buckets, ?, json_extract(percentage_buckets, ?) + 1),
+                score_counts = json_set(score_counts, ?, COALESCE(json_extract(score_counts, ?), 0) + 1)
+        ''', (quiz_id, empty_buckets(), bucket_path, score_path,
+              bucket_path, bucket_path, score_path, score_path))
+    
+    def get_score_histogram(self, quiz_id):
+        """{'results', 'percentage_buckets', 'score_counts'} for a quiz, or None without results"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM score_histograms WHERE quiz_id = ?', (quiz_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return {
+                'results': row['results'],
+                'percentage_buckets': json.loads(row['percentage_buckets']),
+                'score_counts': json.loads(row['score_counts'])
+            }
+    
+    def rebuild_histograms(self, quiz_id=None):
+        """Recount histograms from stored and archived results. Returns the number of quizzes."""
+        counts = {}
+        for row in self.archive.iter_results(quiz_id):
+            key = (row['quiz_id'], row['score'], row['percentage'])
+            counts[key] = counts.get(key, 0) + 1
+        
+        where, params = ('WHERE quiz_id = ?', (quiz_id,)) if quiz_id is not None else ('', ())
+        with self.get_connection() as conn:
+            # Block writers so no result lands between the count and the replace
+            conn.execute('BEGIN IMMEDIATE')
+            for row in conn.execute(
+                f'SELECT quiz_id, score, percentage, COUNT(*) FROM results {where} GROUP BY quiz_id, score, percentage',
+                params
+            ):
+                key = (row[0], row[1], row[2])
+                counts[key] = counts.get(key, 0) + row[3]
+            
+            # Archives still hold results of deleted quizzes
+            existing = {row[0] for row in conn.execute('SELECT id FROM quizzes')}
+            by_quiz = {}
+            for (qid, score, percentage), count in counts.items():
+                if qid in existing:
+                    by_quiz.setdefault(qid, []).append((score, percentage, count))
+            
+            conn.execute(f'DELETE FROM score_histograms {where}', params)
+            for qid, rows in by_quiz.items():
+                histogram = build_histogram(rows)
+                conn.execute(
+                    'INSERT INTO score_histograms (quiz_id, results, percentage_buckets, score_counts) VALUES (?, ?, ?, ?)',
+                    (qid, histogram['results'], json.dumps(histogram['percentage_buckets']),
+                     json.dumps(histogram['score_counts']))
+                )
+            return len(by_quiz)
     
-    def get_results(self, limit=50):
-        """Get recent results"""
+    def get_attempt_result(self, attempt_id):
+        """The result saved for an attempt, or None if it hasn't been finalized"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM results WHERE attempt_id = ?', (attempt_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return {
+                'id': row['id'],
+                'quiz_id': row['quiz_id'],
+                'score': row['score'],
+                'total': row['total'],
+                'percentage': row['percentage'],
+                'answers': decode_answers(row['answers']),
+                'taken_at': row['taken_at']
+            }
+    
+    def create_attempt(self, attempt_id, quiz_id, deadline, seed=None):
+        """Record the start of an attempt, its server-side deadline and layout seed"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO attempts (id, quiz_id, started_at, deadline, seed) VALUES (?, ?, ?, ?, ?)',
+                (attempt_id, quiz_id, time.time(), deadline, seed)
+            )
+    
+    def abandon_attempt(self, attempt_id):
+        """Close an attempt replaced by a restart without saving a result.
+        
+        Returns True if it was still open. The deadline scheduler skips it from then on.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE attempts SET finalized_at = ? WHERE id = ? AND finalized_at IS NULL',
+                (time.time(), attempt_id)
+            )
+            return cursor.rowcount == 1
+    
+    def _attempt_from_row(self, row):
+        return {
+            'id': row['id'],
+            'quiz_id': row['quiz_id'],
+            'started_at': row['started_at'],
+            'deadline': row['deadline'],
+            'seed': row['seed'],
+            'answers': json.loads(row['answers']),
+            'current_position': row['current_position'] or 0,
+            'finalized_at': row['finalized_at'],
+            'result_id': row['result_id']
+        }
+    
+    def get_attempt(self, attempt_id):
+        """Get an attempt by ID"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM attempts WHERE id = ?', (attempt_id,))
+            row = cursor.fetchone()
+            return self._attempt_from_row(row) if row else None
+    
+    def get_open_attempts(self, attempt_ids):
+        """Get the attempts from attempt_ids that have not been finalized"""
+        if not attempt_ids:
+            return []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(attempt_ids))
+            cursor.execute(
+                f'SELECT * FROM attempts WHERE id IN ({placeholders}) AND finalized_at IS NULL',
+                list(attempt_ids)
+            )
+            return [self._attempt_from_row(row) for row in cursor.fetchall()]
+    
+    def get_monitor_attempts(self, since=None, attempt_id=None):
+        """Attempts for the live monitor, with their result once finalized.
+
+        Either one attempt by ID, or every attempt still open with a deadline
+        after since plus those finalized after since.
+        """
+        sql = '''
+            SELECT a.*, r.score, r.total, r.percentage
+            FROM attempts a LEFT JOIN results r ON r.id = a.result_id
+        '''
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if attempt_id is not None:
+                cursor.execute(sql + 'WHERE a.id = ?', (attempt_id,))
+            else:
+                cursor.execute(
+                    sql + 'WHERE (a.finalized_at IS NULL AND a.deadline > ?) OR a.finalized_at > ?',
+                    (since, since)
+                )
+            return [dict(self._attempt_from_row(row), score=row['score'], total=row['total'],
+                         percentage=row['percentage']) for row in cursor.fetchall()]
+
+    def get_open_attempt_deadlines(self):
+        """Get (id, deadline) for every unfinalized attempt"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, deadline FROM attempts WHERE finalized_at IS NULL')
+            return [(row['id'], row['deadline']) for row in cursor.fetchall()]
+    
+    def get_expired_attempts(self, before, limit=200):
+        """Get unfinalized attempts whose deadline is earlier than before"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT * FROM attempts WHERE finalized_at IS NULL AND deadline < ? ORDER BY deadline LIMIT ?',
+                (before, limit)
+            )
+            return [self._attempt_from_row(row) for row in cursor.fetchall()]
+    
+    def save_attempt_answer(self, attempt_id, question_index, answer, not_before, position=0):
+        """Record an answer unless the attempt is finalized or its deadline is earlier than not_before.
+        
+        position is where the question was shown, kept for the live monitor.
+        Returns True if the answer was accepted.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''UPDATE attempts SET answers = json_set(answers, '$."' || ? || '"', ?), current_position = ?
+                   WHERE id = ? AND finalized_at IS NULL AND deadline >= ?''',
+                (str(question_index), answer, position, attempt_id, not_before)
+            )
+            return cursor.rowcount == 1
+    
+    def finalize_attempts(self, finalized):
+        """Finalize attempts and save their results in one transaction.
+        
+        finalized is a list of dicts with attempt_id, quiz_id, quiz_title, score,
+        total, percentage and answers. An attempt's result is inserted only if it
+        has none yet (results.attempt_id is UNIQUE) and the attempt is still open,
+        so attempts already finalized or abandoned elsewhere are skipped.
+        Returns {attempt_id: result_id} for the attempts finalized here.
+        """
+        saved = {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            now = time.time()
+            for item in finalized:
+                cursor.execute(
+                    '''INSERT INTO results (quiz_id, quiz_title, score, total, percentage, answers, attempt_id)
+                       SELECT ?, ?, ?, ?, ?, ?, ?
+                       WHERE EXISTS (SELECT 1 FROM attempts WHERE id = ? AND finalized_at IS NULL)
+                       ON CONFLICT(attempt_id) DO NOTHING''',
+                    (item['quiz_id'], item['quiz_title'], item['score'], item['total'],
+                     item['percentage'], encode_answers(item['answers']), item['attempt_id'],
+                     item['attempt_id'])
+                )
+                if cursor.rowcount != 1:
+                    continue
+                result_id = cursor.lastrowid
+                cursor.execute(
+                    'UPDATE attempts SET finalized_at = ?, result_id = ? WHERE id = ?',
+                    (now, result_id, item['attempt_id'])
+                )
+                self._count_result(cursor, item['quiz_id'], item['score'], item['percentage'])
+                saved[item['attempt_id']] = result_id
+        return saved
+    
+    def get_results(self, limit=50, include_archived=False):
+        """Get recent results, topped up from the archives if include_archived"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM results ORDER BY taken_at DESC LIMIT ?', (limit,))
             rows = cursor.fetchall()
             
-            return [{
+            results = [{
                 'id': row['id'],
                 'quiz_id': row['quiz_id'],
                 'quiz_title': row['quiz_title'],
                 'score': row['score'],
                 'total': row['total'],
                 'percentage': row['percentage'],
-                'answers': json.loads(row['answers']),
+                'answers': decode_answers(row['answers']),
                 'taken_at': row['taken_at']
             } for row in rows]
+        
+        if include_archived and len(results) < limit:
+            for row in self.archive.iter_results(newest_first=True):
+                if len(results) == limit:
+                    break
+                results.append({key: row[key] for key in
+                                ('id', 'quiz_id', 'quiz_title', 'score', 'total', 'percentage', 'answers', 'taken_at')})
+        return results
+    
+    def get_quiz_results(self, quiz_id, batch_size=1000, include_archived=False):
+        """Yield every result for a quiz in ID order, fetching batch_size rows at a time.
+        
+        With include_archived, archived results come first (they are the oldest).
+        """
+        if include_archived:
+            for row in self.archive.iter_results(quiz_id):
+                yield {key: row[key] for key in ('id', 'score', 'total', 'percentage', 'answers', 'taken_at')}
+        
+        last_id = 0
+        while True:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT * FROM results WHERE quiz_id = ? AND id > ? ORDER BY id LIMIT ?',
+                    (quiz_id, last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+            for row in rows:
+                yield {
+                    'id': row['id'],
+                    'score': row['score'],
+                    'total': row['total'],
+                    'percentage': row['percentage'],
+                    'answers': decode_answers(row['answers']),
+                    'taken_at': row['taken_at']
+                }
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+    
+    def migrate_answers(self, batch_size=1000):
+        """Convert JSON answers to packed BLOBs in small transactions. Returns rows converted."""
+        converted = 0
+        while True:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT id, answers FROM results WHERE typeof(answers) = 'text' LIMIT ?",
+                    (batch_size,)
+                )
+                rows = cursor.fetchall()
+                cursor.executemany(
+                    'UPDATE results SET answers = ? WHERE id = ?',
+                    [(encode_answers(json.loads(row['answers'])), row['id']) for row in rows]
+                )
+            converted += len(rows)
+            if len(rows) < batch_size:
+                return converted
+    
+    def archive_old_rows(self, cutoff, batch_size=500):
+        """Move results and read contact messages older than cutoff into the archives.
+        
+        cutoff is a 'YYYY-MM-DD HH:MM:SS' UTC timestamp. Each batch holds the write
+        lock while it is archived and deleted, so concurrent runs cannot both
+        archive it. Finalized attempts older than cutoff are deleted.
+        Returns {'results': n, 'messages': n, 'attempts': n}.
+        """
+        moved = {'results': 0, 'messages': 0}
+        sources = (('results', 'results', 'taken_at', ''),
+                   ('messages', 'contact_messages', 'created_at', 'AND read = 1'))
+        for kind, table, timestamp_key, condition in sources:
+            while True:
+                with self.get_connection() as conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    rows = conn.execute(
+                        f'SELECT * FROM {table} WHERE {timestamp_key} < ? {condition} ORDER BY id LIMIT ?',
+                        (cutoff, batch_size)
+                    ).fetchall()
+                    if rows:
+                        # Written and synced before the rows are deleted here
+                        self.archive.write(kind, [archive_row(row) for row in rows], timestamp_key)
+                        conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in rows])
+                moved[kind] += len(rows)
+                if len(rows) < batch_size:
+                    break
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM attempts WHERE finalized_at IS NOT NULL AND finalized_at < CAST(strftime('%s', ?) AS REAL)",
+                (cutoff,)
+            )
+            moved['attempts'] = cursor.rowcount
+        return moved
+    
+    def last_maintenance_run(self, task):
+        """Epoch time a maintenance task last completed, or 0 if it never has"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT last_run FROM maintenance_runs WHERE task = ?', (task,))
+            row = cursor.fetchone()
+            return row['last_run'] if row else 0
+    
+    def record_maintenance_run(self, task, when):
+        """Record that a maintenance task completed at epoch time when"""
+        with self.get_connection() as conn:
+            conn.execute(
+                'INSERT INTO maintenance_runs (task, last_run) VALUES (?, ?) '
+                'ON CONFLICT(task) DO UPDATE SET last_run = excluded.last_run',
+                (task, when)
+            )
+    
+    def has_active_attempts(self, now):
+        """Whether any attempt is still running at epoch time now"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM attempts WHERE finalized_at IS NULL AND deadline > ? LIMIT 1', (now,))
+            return cursor.fetchone() is not None
+    
+    def checkpoint(self):
+        """Copy the WAL into the database file and truncate it. Returns (busy, log pages, checkpointed)."""
+        with self.get_connection() as conn:
+            return tuple(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone())
+    
+    def incremental_vacuum(self, pages):
+        """Return up to pages free pages to the filesystem. Returns the number still free."""
+        with self.get_connection() as conn:
+            # executescript steps the pragma to completion; execute frees a single page
+            conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+            return conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the file with VACUUM)"""
+        with self.get_connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        # VACUUM can't run inside a transaction
+        conn.execute('VACUUM')
+        return True
     
     def save_contact_message(self, name, email, subject, message):
         """Save contact form message"""
@@ -182,8 +869,8 @@ class Database:
             )
             return cursor.lastrowid
     
-    def get_contact_messages(self, limit=50, unread_only=False):
-        """Get contact messages"""
+    def get_contact_messages(self, limit=50, unread_only=False, include_archived=False):
+        """Get contact messages, topped up from the archives if include_archived"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             if unread_only:
@@ -192,7 +879,7 @@ class Database:
                 cursor.execute('SELECT * FROM contact_messages ORDER BY created_at DESC LIMIT ?', (limit,))
             rows = cursor.fetchall()
             
-            return [{
+            messages = [{
                 'id': row['id'],
                 'name': row['name'],
                 'email': row['email'],
@@ -201,6 +888,214 @@ class Database:
                 'created_at': row['created_at'],
                 'read': row['read']
             } for row in rows]
+        
+        # Only read messages are archived
+        if include_archived and not unread_only and len(messages) < limit:
+            for row in self.archive.iter_messages():
+                if len(messages) == limit:
+                    break
+                messages.append({key: row[key] for key in
+                                 ('id', 'name', 'email', 'subject', 'message', 'created_at', 'read')})
+        return messages
+    
+    def _ranked_page(self, cursor, table, match, limit, after):
+        """One page of FTS matches as (rank, rowid, bound) tuples, best first.
+        
+        Up to SEARCH_CANDIDATES matches are ranked together, which covers every
+        match of all but the commonest terms. Past that, the newest
+        SEARCH_CANDIDATES are ranked first and the page continues with the next
+        older batch once one runs out; bound is the exclusive rowid limit of a
+        tuple's batch (None for the newest). Returns (page, ranked_all) where
+        ranked_all says whether the order covered every match.
+        """
+        rank_after, id_after, bound = after if after else (None, None, None)
+        page = []
+        ranked_all = bound is None
+        while len(page) < limit:
+            below = 'AND rowid < ?' if bound is not None else ''
+            cursor.execute(
+                f'SELECT rowid, rank FROM {table} WHERE {table} MATCH ? {below} ORDER BY rowid DESC LIMIT ?',
+                [match] + ([bound] if bound is not None else []) + [SEARCH_CANDIDATES]
+            )
+            batch = sorted((row['rank'], row['rowid']) for row in cursor.fetchall())
+            remaining = batch
+            if rank_after is not None:
+                remaining = [entry for entry in batch if entry > (rank_after, id_after)]
+                rank_after = None
+            page += [(rank, rowid, bound) for rank, rowid in remaining[:limit - len(page)]]
+            if len(batch) < SEARCH_CANDIDATES:
+                break
+            ranked_all = False
+            bound = min(rowid for _, rowid in batch)
+        return page, ranked_all
+    
+    def _snippets(self, cursor, table, columns, match, ids):
+        """{rowid: (snippet, ...)} for ids, highlighted in one MATCH pass over their rowid range.
+        
+        columns are (column, tokens) pairs. The unary + keeps the IN list out of
+        the full-text index lookup, which would re-run the MATCH once per id.
+        """
+        snippets = ', '.join(f"snippet({table}, {column}, ?, ?, '…', {tokens})" for column, tokens in columns)
+        cursor.execute(f'''
+            SELECT rowid, {snippets} FROM {table}
+            WHERE {table} MATCH ? AND rowid BETWEEN ? AND ? AND +rowid IN ({','.join('?' for _ in ids)})
+        ''', [MARK_START, MARK_END] * len(columns) + [match, min(ids), max(ids)] + list(ids))
+        return {row[0]: tuple(row)[1:] for row in cursor.fetchall()}
+    
+    def search_questions(self, query, limit=20, after=None):
+        """Full-text search over quiz and pool questions, best matches first.
+        
+        after is a cursor tuple from decode_cursor. Returns (results, next_cursor,
+        ranked_all); see _ranked_page for when the order is not global.
+        """
+        match = fts_query(query)
+        if not match:
+            return [], None, True
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            page, ranked_all = self._ranked_page(cursor, 'question_fts', match, limit, after)
+            if not page:
+                return [], None, ranked_all
+            
+            ids = [rowid for _, rowid, _ in page]
+            snippets = self._snippets(cursor, 'question_fts', [(0, 16), (1, 12)], match, ids)
+            cursor.execute(f'''
+                SELECT s.id, s.source, s.owner_id, s.position, q.title AS quiz_title, p.name AS pool_name
+                FROM question_search s
+                LEFT JOIN quizzes q ON s.source = 'quiz' AND q.id = s.owner_id
+                LEFT JOIN question_pools p ON s.source = 'pool' AND p.id = s.owner_id
+                WHERE s.id IN ({','.join('?' for _ in ids)})
+            ''', ids)
+            rows = {row['id']: row for row in cursor.fetchall()}
+        
+        results = [{
+            'id': row['id'],
+            'source': row['source'],
+            'owner_id': row['owner_id'],
+            'owner_name': row['quiz_title'] if row['source'] == 'quiz' else row['pool_name'],
+            'number': row['position'] + 1,
+            'text_html': highlight_html(text_snippet),
+            'options_html': highlight_html(options_snippet)
+        } for row, (text_snippet, options_snippet) in
+            ((rows[rowid], snippets[rowid]) for rowid in ids if rowid in rows and rowid in snippets)]
+        next_cursor = encode_cursor(*page[-1]) if len(page) == limit else None
+        return results, next_cursor, ranked_all
+    
+    def save_question_signatures(self, source, owner_id, first_position, signatures):
+        """Index MinHash signatures for questions first_position onwards of a quiz or pool"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT id FROM question_search WHERE source = ? AND owner_id = ? AND position >= ?
+                   ORDER BY position''',
+                (source, owner_id, first_position)
+            )
+            ids = [row['id'] for row in cursor.fetchall()]
+            self._insert_signatures(cursor, zip(ids, signatures))
+    
+    def _insert_signatures(self, cursor, rows):
+        rows = list(rows)
+        cursor.executemany(
+            'INSERT OR REPLACE INTO question_signatures (question_id, signature) VALUES (?, ?)',
+            [(question_id, signature.tobytes()) for question_id, signature in rows]
+        )
+        cursor.executemany(
+            'INSERT OR IGNORE INTO question_lsh (band, bucket, question_id) VALUES (?, ?, ?)',
+            [(band, bucket, question_id)
+             for question_id, signature in rows
+             for band, bucket in band_buckets(signature)]
+        )
+    
+    def index_missing_signatures(self, batch_size=500):
+        """Compute signatures for questions that have none yet. Returns the number indexed."""
+        indexed = 0
+        last_id = 0
+        while True:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT s.id, s.text, s.options FROM question_search s
+                    LEFT JOIN question_signatures g ON g.question_id = s.id
+                    WHERE g.question_id IS NULL AND s.id > ?
+                    ORDER BY s.id LIMIT ?
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    return indexed
+                
+                self._insert_signatures(cursor, [
+                    (row['id'], minhash({'text': row['text'],
+                                         'options': row['options'].split(' | ') if row['options'] else []}))
+                    for row in rows
+                ])
+                indexed += len(rows)
+                last_id = rows[-1]['id']
+    
+    def find_signature_candidates(self, buckets):
+        """Stored questions sharing at least one LSH (band, bucket) with a signature"""
+        values = ','.join('(?, ?)' for _ in buckets)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT s.source, s.owner_id, s.position, g.signature,
+                       q.title AS quiz_title, p.name AS pool_name
+                FROM (SELECT DISTINCT l.question_id FROM (VALUES {values}) v
+                      JOIN question_lsh l ON l.band = v.column1 AND l.bucket = v.column2) c
+                JOIN question_signatures g ON g.question_id = c.question_id
+                JOIN question_search s ON s.id = c.question_id
+                LEFT JOIN quizzes q ON s.source = 'quiz' AND q.id = s.owner_id
+                LEFT JOIN question_pools p ON s.source = 'pool' AND p.id = s.owner_id
+            ''', [value for key in buckets for value in key])
+            rows = cursor.fetchall()
+        
+        candidates = []
+        for row in rows:
+            signature = array('I')
+            signature.frombytes(row['signature'])
+            if row['source'] == 'quiz':
+                label = f'quiz "{row["quiz_title"]}" Q{row["position"] + 1}'
+            else:
+                label = f'pool "{row["pool_name"]}" #{row["position"] + 1}'
+            candidates.append({'label': label, 'signature': signature})
+        return candidates
+    
+    def search_messages(self, query, limit=20, after=None):
+        """Full-text search over contact messages, best matches first.
+        
+        Ranked like search_questions. after is a cursor tuple from decode_cursor.
+        Returns (results, next_cursor, ranked_all).
+        """
+        match = fts_query(query)
+        if not match:
+            return [], None, True
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            page, ranked_all = self._ranked_page(cursor, 'contact_messages_fts', match, limit, after)
+            if not page:
+                return [], None, ranked_all
+            
+            ids = [rowid for _, rowid, _ in page]
+            snippets = self._snippets(cursor, 'contact_messages_fts', [(0, 12), (1, 24)], match, ids)
+            cursor.execute(f'''
+                SELECT id, name, email, created_at, read FROM contact_messages
+                WHERE id IN ({','.join('?' for _ in ids)})
+            ''', ids)
+            rows = {row['id']: row for row in cursor.fetchall()}
+        
+        results = [{
+            'id': row['id'],
+            'name': row['name'],
+            'email': row['email'],
+            'created_at': row['created_at'],
+            'read': row['read'],
+            'subject_html': highlight_html(subject_snippet),
+            'message_html': highlight_html(message_snippet)
+        } for row, (subject_snippet, message_snippet) in
+            ((rows[rowid], snippets[rowid]) for rowid in ids if rowid in rows and rowid in snippets)]
+        next_cursor = encode_cursor(*page[-1]) if len(page) == limit else None
+        return results, next_cursor, ranked_all
     
     def mark_message_read(self, message_id):
         """Mark contact message as read"""
@@ -1,11 +1,35 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, Response, jsonify
 from models.database import Database
-from utils.parsers import parse_gift, parse_yaml, validate_questions
+from utils.parsers import parse_gift, parse_yaml, validate_questions, parse_pool_draws
+from utils.monitor import make_stream_token
+from utils.search import SEARCH_CANDIDATES, decode_cursor
+from utils.dedup import find_duplicates, describe_duplicates
 from config import Config
+import csv
+import io
+import os
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 db = Database()
 
+def uploaded_images():
+    """{file name: bytes} of the images sent with a quiz or pool upload"""
+    return {os.path.basename(f.filename): f.read()
+            for f in request.files.getlist('images') if f.filename}
+
+def store_question_images(questions):
+    """Move inline and uploaded images into the media store. Returns how many were referenced."""
+    from app import media_store
+    return media_store.rewrite_questions(questions, uploaded_images())
+
+def rebuild_quiz_store():
+    """Recompile the shared quiz store after quizzes change"""
+    from app import quiz_store
+    try:
+        quiz_store.rebuild()
+    except Exception:
+        current_app.logger.exception('Could not rebuild the compiled quiz store')
+
 def admin_required(f):
     """Decorator to require admin login"""
     def decorated_function(*args, **kwargs):
@@ -40,6 +64,7 @@ def logout():
 def dashboard():
     """Admin dashboard"""
     quizzes = db.get_all_quizzes()
+    pools = db.get_pools()
     results = db.get_results(limit=20)
     
     # Get unread message count
@@ -48,15 +73,17 @@ def dashboard():
     
     return render_template('admin/dashboard.html', 
                          quizzes=quizzes, 
+                         pools=pools,
                          results=results,
                          unread_count=unread_count)
 
 @admin.route('/messages')
 @admin_required
 def messages():
-    """View contact messages"""
-    all_messages = db.get_contact_messages(limit=100)
-    return render_template('admin/messages.html', messages=all_messages)
+    """View contact messages (add archived=1 to include archived ones)"""
+    include_archived = request.args.get('archived') == '1'
+    all_messages = db.get_contact_messages(limit=100, include_archived=include_archived)
+    return render_template('admin/messages.html', messages=all_messages, include_archived=include_archived)
 
 @admin.route('/messages/<int:message_id>/read', methods=['POST'])
 @admin_required
@@ -69,6 +96,52 @@ def mark_read(message_id):
         flash('Error updating message', 'error')
     return redirect(url_for('admin.messages'))
 
+@admin.route('/search')
+@admin_required
+def search():
+    """Full-text search over questions or contact messages (add format=json for JSON)"""
+    query = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'questions')
+    after = decode_cursor(request.args.get('after'))
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    
+    results, next_cursor, ranked_all = [], None, True
+    if query:
+        if scope == 'messages':
+            results, next_cursor, ranked_all = db.search_messages(query, limit, after)
+        else:
+            scope = 'questions'
+            results, next_cursor, ranked_all = db.search_questions(query, limit, after)
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'query': query, 'scope': scope, 'results': results, 'next': next_cursor,
+                        'ranked_all': ranked_all})
+    
+    return render_template('admin/search.html',
+                         query=query,
+                         scope=scope,
+                         results=results,
+                         next_cursor=next_cursor,
+                         ranked_all=ranked_all,
+                         candidates=SEARCH_CANDIDATES)
+
+@admin.route('/monitor')
+@admin_required
+def monitor():
+    """Live exam monitor"""
+    base_url = Config.MONITOR_PUBLIC_URL or f'{request.scheme}://{request.host.split(":")[0]}:{Config.MONITOR_PORT}'
+    stream_url = f'{base_url.rstrip("/")}/events?token={make_stream_token(Config.SECRET_KEY)}'
+    return render_template('admin/monitor.html',
+                         stream_url=stream_url,
+                         enabled=Config.MONITOR_ENABLED)
+
+@admin.route('/metrics')
+@admin_required
+def metrics():
+    """Admission control counters for this worker process"""
+    from app import admission
+    return jsonify(admission.metrics())
+
 @admin.route('/upload', methods=['POST'])
 @admin_required
 def upload():
@@ -76,17 +149,41 @@ def upload():
     title = request.form.get('title', '').strip()
     format_type = request.form.get('format', 'yaml')
     content = request.form.get('content', '').strip()
+    pool_draws_text = request.form.get('pool_draws', '').strip()
     timer_minutes = int(request.form.get('timer_minutes', Config.DEFAULT_QUIZ_TIMER))
+    shuffle_questions = request.form.get('shuffle_questions') == '1'
+    shuffle_options = request.form.get('shuffle_options') == '1'
     
     if not title:
         flash('Quiz title is required', 'error')
         return redirect(url_for('admin.dashboard'))
     
-    if not content:
-        flash('Quiz content is required', 'error')
+    if not content and not pool_draws_text:
+        flash('Quiz content or pool draws are required', 'error')
         return redirect(url_for('admin.dashboard'))
     
     try:
+        if pool_draws_text:
+            # Pool quiz - each attempt draws its own questions
+            pools = {pool['name']: pool for pool in db.get_pools()}
+            pool_draws = []
+            for name, count in parse_pool_draws(pool_draws_text):
+                pool = pools.get(name)
+                if not pool:
+                    flash(f'Unknown question pool "{name}"', 'error')
+                    return redirect(url_for('admin.dashboard'))
+                if count > pool['size']:
+                    flash(f'Pool "{name}" has only {pool["size"]} questions', 'error')
+                    return redirect(url_for('admin.dashboard'))
+                # Snapshot the size so attempts stay reproducible as the pool grows
+                pool_draws.append({'pool_id': pool['id'], 'count': count, 'size': pool['size']})
+            
+            db.create_quiz(title, [], timer_minutes, pool_draws, shuffle_questions, shuffle_options)
+            rebuild_quiz_store()
+            total = sum(draw['count'] for draw in pool_draws)
+            flash(f'Quiz "{title}" created successfully drawing {total} questions from pools', 'success')
+            return redirect(url_for('admin.dashboard'))
+        
         # Parse questions based on format
         if format_type == 'gift':
             questions = parse_gift(content)
@@ -99,21 +196,93 @@ def upload():
             flash(f'Validation error: {error_msg}', 'error')
             return redirect(url_for('admin.dashboard'))
         
+        images = store_question_images(questions)
+        signatures, duplicates = find_duplicates(db, questions)
+        
         # Create quiz
-        quiz_id = db.create_quiz(title, questions, timer_minutes)
-        flash(f'Quiz "{title}" created successfully with {len(questions)} questions', 'success')
+        quiz_id = db.create_quiz(title, questions, timer_minutes,
+                                 shuffle_questions=shuffle_questions,
+                                 shuffle_options=shuffle_options)
+        db.save_question_signatures('quiz', quiz_id, 0, signatures)
+        rebuild_quiz_store()
+        flash(f'Quiz "{title}" created successfully with {len(questions)} questions'
+              + (f' and {images} images' if images else ''), 'success')
+        if duplicates:
+            flash(describe_duplicates(duplicates), 'warning')
         
     except Exception as e:
         flash(f'Error parsing quiz: {str(e)}', 'error')
     
     return redirect(url_for('admin.dashboard'))
 
+@admin.route('/pools/upload', methods=['POST'])
+@admin_required
+def upload_pool():
+    """Add questions to a question pool"""
+    name = request.form.get('pool_name', '').strip()
+    format_type = request.form.get('format', 'yaml')
+    content = request.form.get('content', '').strip()
+    
+    if not name or not content:
+        flash('Pool name and content are required', 'error')
+        return redirect(url_for('admin.dashboard'))
+    
+    try:
+        if format_type == 'gift':
+            questions = parse_gift(content)
+        else:
+            questions = parse_yaml(content)
+        
+        valid, error_msg = validate_questions(questions)
+        if not valid:
+            flash(f'Validation error: {error_msg}', 'error')
+            return redirect(url_for('admin.dashboard'))
+        
+        images = store_question_images(questions)
+        signatures, duplicates = find_duplicates(db, questions)
+        pool_id, first_position = db.add_pool_questions(name, questions)
+        db.save_question_signatures('pool', pool_id, first_position, signatures)
+        flash(f'Added {len(questions)} questions to pool "{name}"'
+              + (f' with {images} images' if images else ''), 'success')
+        if duplicates:
+            flash(describe_duplicates(duplicates), 'warning')
+        
+    except Exception as e:
+        flash(f'Error parsing questions: {str(e)}', 'error')
+    
+    return redirect(url_for('admin.dashboard'))
+
+@admin.route('/results/<int:quiz_id>/export.csv')
+@admin_required
+def export_results(quiz_id):
+    """Download all results of a quiz as CSV, one column per question (archived=1 adds archived results)"""
+    include_archived = request.args.get('archived') == '1'
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header_written = False
+        for result in db.get_quiz_results(quiz_id, include_archived=include_archived):
+            if not header_written:
+                writer.writerow(['result_id', 'taken_at', 'score', 'total', 'percentage'] +
+                                [f'q{i + 1}' for i in range(len(result['answers']))])
+                header_written = True
+            writer.writerow([result['id'], result['taken_at'], result['score'],
+                             result['total'], result['percentage']] + list(result['answers']))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    return Response(generate(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=quiz-{quiz_id}-results.csv'})
+
 @admin.route('/delete/<int:quiz_id>', methods=['POST'])
 @admin_required
 def delete(quiz_id):
     """Delete a quiz"""
     try:
         db.delete_quiz(quiz_id)
+        rebuild_quiz_store()
         flash('Quiz deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting quiz: {str(e)}', 'error')
@@ -4,8 +4,15 @@ from models.database import Database
 main = Blueprint('main', __name__)
 db = Database()
 
+def get_quiz_store():
+    """Get compiled quiz store from current app"""
+    from app import quiz_store
+    return quiz_store
+
 @main.route('/')
 def home():
     """Home page with available quizzes"""
-    quizzes = db.get_all_quizzes()
+    quizzes = get_quiz_store().get_all_quizzes()
+    if quizzes is None:
+        quizzes = db.get_all_quizzes()
     return render_template('home.html', quizzes=quizzes)
\ No newline at end of file
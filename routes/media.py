@@ -0,0 +1,40 @@
+from flask import Blueprint, abort, send_file
+from utils.media import MEDIA_URL, NAME_PATTERN, MIMETYPES
+import os
+
+media = Blueprint('media', __name__, url_prefix=MEDIA_URL)
+
+# Stored files never change - their name is the hash of their content
+MAX_AGE = 365 * 24 * 60 * 60
+
+def get_media_store():
+    """Get media store from current app"""
+    from app import media_store
+    return media_store
+
+def send_image(name, thumbnail=False):
+    """Stream a stored image straight from disk with range and immutable caching support"""
+    match = NAME_PATTERN.match(name)
+    if not match:
+        abort(404)
+    path = get_media_store().path(name, thumbnail)
+    if not os.path.isfile(path):
+        abort(404)
+    
+    # send_file hands the open file to the server's wsgi.file_wrapper (sendfile
+    # where supported) and answers Range / If-None-Match requests
+    response = send_file(path, mimetype=MIMETYPES[match.group(2)], conditional=True,
+                         etag=match.group(1), max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@media.route('/<name>')
+def image(name):
+    """Full-size image"""
+    return send_image(name)
+
+@media.route('/thumbs/<name>')
+def thumbnail(name):
+    """Thumbnail generated at upload"""
+    return send_image(name, thumbnail=True)
@@ -1,59 +1,132 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
 from models.database import Database
 from utils.helpers import calculate_score, render_markdown
+from utils.deadlines import answers_to_list, score_attempt
+from utils.sampling import (new_seed, attempt_answer_key, attempt_question, attempt_questions, question_order,
+                            option_order, shuffle_options)
+from utils.histograms import percentile_rank, distribution
+from utils import monitor
+from config import Config
+import time
+import uuid
 
 quiz = Blueprint('quiz', __name__, url_prefix='/quiz')
 db = Database()
 
+def get_quiz_store():
+    """Get compiled quiz store from current app"""
+    from app import quiz_store
+    return quiz_store
+
+def load_quiz(quiz_id):
+    """Get a quiz from the shared compiled store, falling back to the database"""
+    return get_quiz_store().get_quiz(quiz_id) or db.get_quiz(quiz_id)
+
+def get_deadlines():
+    """Get deadline scheduler from current app"""
+    from app import deadlines
+    return deadlines
+
+def time_expired(quiz_id):
+    """Whether the server-side deadline (plus grace) for this session's attempt has passed"""
+    deadline = session.get(f'quiz_{quiz_id}_deadline')
+    return deadline is not None and time.time() > deadline + Config.DEADLINE_GRACE_SECONDS
+
 @quiz.route('/<int:quiz_id>/start')
 def start(quiz_id):
     """Start a quiz"""
-    quiz_data = db.get_quiz(quiz_id)
+    quiz_data = load_quiz(quiz_id)
     
     if not quiz_data:
         return redirect(url_for('main.home'))
     
-    # Initialize session data
+    # Starting again while an attempt is running resumes it. A replaced attempt
+    # is closed without a result, so the deadline scheduler never scores it.
+    previous = session.get(f'quiz_{quiz_id}_attempt')
+    attempt = db.get_attempt(previous) if previous else None
+    if attempt and attempt['finalized_at'] is None:
+        if time.time() <= attempt['deadline'] + Config.DEADLINE_GRACE_SECONDS:
+            return redirect(url_for('quiz.question', quiz_id=quiz_id,
+                                    q=session.get(f'quiz_{quiz_id}_current', 0)))
+        if db.abandon_attempt(previous):
+            monitor.publish('restart', previous)
+    
+    # Record the attempt with its server-side deadline
+    attempt_id = uuid.uuid4().hex
+    deadline = time.time() + quiz_data['timer_minutes'] * 60
+    seed = new_seed()
+    db.create_attempt(attempt_id, quiz_id, deadline, seed)
+    get_deadlines().schedule(attempt_id, deadline)
+    
+    # Initialize session data - the seed alone determines which questions are
+    # drawn and how they and their options are shuffled
     session[f'quiz_{quiz_id}_answers'] = {}
     session[f'quiz_{quiz_id}_current'] = 0
+    session[f'quiz_{quiz_id}_attempt'] = attempt_id
+    session[f'quiz_{quiz_id}_deadline'] = deadline
+    session[f'quiz_{quiz_id}_seed'] = seed
     session.modified = True
     
+    monitor.publish('start', attempt_id,
+                    quiz_id=quiz_id,
+                    quiz_title=quiz_data['title'],
+                    total=quiz_data['question_count'],
+                    deadline=deadline)
+    
     return redirect(url_for('quiz.question', quiz_id=quiz_id, q=0))
 
 @quiz.route('/<int:quiz_id>/question/<int:q>')
 def question(quiz_id, q):
     """Display a specific question"""
-    quiz_data = db.get_quiz(quiz_id)
+    quiz_data = load_quiz(quiz_id)
     
     if not quiz_data:
         return redirect(url_for('main.home'))
     
-    questions = quiz_data['questions']
-    total = len(questions)
+    total = quiz_data['question_count']
     
     # Validate question index
     if q < 0 or q >= total:
         return redirect(url_for('quiz.question', quiz_id=quiz_id, q=0))
     
+    if time_expired(quiz_id):
+        return redirect(url_for('quiz.complete', quiz_id=quiz_id))
+    
+    # Questions and options are shown shuffled; answers are kept by quiz-order
+    # question index and original option index
+    seed = session.get(f'quiz_{quiz_id}_seed')
+    question = attempt_question(db, quiz_data, seed, q)
+    order = option_order(quiz_data, seed, q, len(question['options']))
+    
+    # Remembered so that starting the quiz again resumes here
+    session[f'quiz_{quiz_id}_current'] = q
+    
     # Get current answers
     answers = session.get(f'quiz_{quiz_id}_answers', {})
-    current_answer = answers.get(str(q))
+    current_answer = answers.get(str(question_order(quiz_data, seed)[q]))
+    if current_answer is not None and current_answer in order:
+        current_answer = order.index(current_answer)
+    
+    # Seconds left on the server clock; the client timer counts down from this
+    deadline = session.get(f'quiz_{quiz_id}_deadline')
+    remaining_seconds = max(0, int(deadline - time.time())) if deadline is not None else None
     
     return render_template(
         'quiz/take.html',
         quiz=quiz_data,
         quiz_id=quiz_id,
-        question=questions[q],
+        question=shuffle_options(question, order),
         question_index=q,
         total_questions=total,
         current_answer=current_answer,
+        remaining_seconds=remaining_seconds,
         render_markdown=render_markdown
     )
 
 @quiz.route('/<int:quiz_id>/submit', methods=['POST'])
 def submit_answer(quiz_id):
     """Submit answer for current question"""
-    quiz_data = db.get_quiz(quiz_id)
+    quiz_data = load_quiz(quiz_id)
     
     if not quiz_data:
         return jsonify({'error': 'Quiz not found'}), 404
@@ -66,13 +139,32 @@ def submit_answer(quiz_id):
     if answers_key not in session:
         session[answers_key] = {}
     
-    if answer is not None:
-        session[answers_key][str(question_index)] = int(answer)
+    attempt_id = session.get(f'quiz_{quiz_id}_attempt')
+    total = quiz_data['question_count']
+    if answer is not None and 0 <= question_index < total:
+        # Map the displayed question and option back to their original indexes
+        seed = session.get(f'quiz_{quiz_id}_seed')
+        options = attempt_question(db, quiz_data, seed, question_index)['options']
+        order = option_order(quiz_data, seed, question_index, len(options))
+        answer = order[int(answer)] if 0 <= int(answer) < len(order) else -1
+        index = question_order(quiz_data, seed)[question_index]
+        
+        # The database copy is authoritative and refuses answers after the deadline
+        if attempt_id and not db.save_attempt_answer(attempt_id, index, int(answer),
+                                                     time.time() - Config.DEADLINE_GRACE_SECONDS,
+                                                     question_index):
+            return redirect(url_for('quiz.complete', quiz_id=quiz_id))
+        session[answers_key][str(index)] = int(answer)
         session.modified = True
+    elif time_expired(quiz_id):
+        return redirect(url_for('quiz.complete', quiz_id=quiz_id))
+    
+    monitor.publish('answer', attempt_id,
+                    current=question_index,
+                    answered=len(session[answers_key]))
     
     # Determine next action
     action = request.form.get('action', 'next')
-    total = len(quiz_data['questions'])
     
     if action == 'prev' and question_index > 0:
         return redirect(url_for('quiz.question', quiz_id=quiz_id, q=question_index - 1))
@@ -86,25 +178,40 @@ def submit_answer(quiz_id):
 @quiz.route('/<int:quiz_id>/complete')
 def complete(quiz_id):
     """Complete quiz and show results"""
-    quiz_data = db.get_quiz(quiz_id)
+    quiz_data = load_quiz(quiz_id)
     
     if not quiz_data:
         return redirect(url_for('main.home'))
     
-    # Get answers
-    answers_dict = session.get(f'quiz_{quiz_id}_answers', {})
-    questions = quiz_data['questions']
+    attempt_id = session.get(f'quiz_{quiz_id}_attempt')
     
-    # Convert answers dict to list (with -1 for unanswered)
-    answers_list = []
-    for i in range(len(questions)):
-        answers_list.append(answers_dict.get(str(i), -1))
+    # Refreshes, the back button and an auto-submit racing a manual submit
+    # are served the stored result without writing anything
+    result = db.get_attempt_result(attempt_id) if attempt_id else None
     
-    # Calculate score
-    score, total, percentage = calculate_score(answers_list, questions)
+    if result is None:
+        attempt = db.get_attempt(attempt_id) if attempt_id else None
+        if attempt:
+            # Score the server's copy of the answers; it stopped changing at the deadline
+            finalized = score_attempt(db, attempt, quiz_data)
+            if db.finalize_attempts([finalized]):
+                monitor.publish('complete', attempt_id, score=finalized['score'],
+                                total=finalized['total'], percentage=finalized['percentage'])
+            # If the deadline scheduler got there first, its result is the one that counts
+            result = db.get_attempt_result(attempt_id) or finalized
+        else:
+            # Sessions started before attempts were tracked server-side
+            if not attempt_id:
+                attempt_id = uuid.uuid4().hex
+                session[f'quiz_{quiz_id}_attempt'] = attempt_id
+            answer_key = attempt_answer_key(db, quiz_data, None)
+            answers_list = answers_to_list(session.get(f'quiz_{quiz_id}_answers', {}), len(answer_key))
+            score, total, percentage = calculate_score(answers_list, answer_key)
+            db.save_result(quiz_id, quiz_data['title'], score, total, percentage, answers_list, attempt_id)
+            result = {'score': score, 'total': total, 'percentage': percentage, 'answers': answers_list}
     
-    # Save result
-    db.save_result(quiz_id, quiz_data['title'], score, total, percentage, answers_list)
+    score, total, percentage = result['score'], result['total'], result['percentage']
+    answers_list = list(result['answers'])
     
     # Store for review page
     session[f'quiz_{quiz_id}_result'] = {
@@ -115,6 +222,9 @@ def complete(quiz_id):
     }
     session.modified = True
     
+    # Class comparison from the quiz's precomputed histogram - one row read
+    histogram = db.get_score_histogram(quiz_id)
+    
     # Clear timer from localStorage (will be done on client side)
     return render_template(
         'quiz/result.html',
@@ -123,13 +233,16 @@ def complete(quiz_id):
         score=score,
         total=total,
         percentage=percentage,
+        percentile=percentile_rank(histogram, score),
+        distribution=distribution(histogram, percentage),
+        result_count=histogram['results'] if histogram else 0,
         clear_timer=True
     )
 
 @quiz.route('/<int:quiz_id>/review')
 def review(quiz_id):
     """Review quiz answers"""
-    quiz_data = db.get_quiz(quiz_id)
+    quiz_data = load_quiz(quiz_id)
     
     if not quiz_data:
         return redirect(url_for('main.home'))
@@ -140,13 +253,18 @@ def review(quiz_id):
     if not result:
         return redirect(url_for('main.home'))
     
-    questions = quiz_data['questions']
+    seed = session.get(f'quiz_{quiz_id}_seed')
+    questions = attempt_questions(db, quiz_data, seed)
     answers = result['answers']
     
-    # Build review data
+    # Build review data, showing questions and options in the order the student saw them
     review_data = []
-    for i, question in enumerate(questions):
-        user_answer = answers[i] if i < len(answers) else -1
+    for i, index in enumerate(question_order(quiz_data, seed)):
+        question = questions[index]
+        order = option_order(quiz_data, seed, i, len(question['options']))
+        user_answer = answers[index] if index < len(answers) else -1
+        user_answer = order.index(user_answer) if user_answer in order else -1
+        question = shuffle_options(question, order)
         correct_answer = question['correct']
         
         review_data.append({
@@ -7,15 +7,22 @@ echo "==============================================="
 export FLASK_ENV=production
 export SECRET_KEY=$(python -c 'import secrets; print(secrets.token_hex(32))')
 
+# Request threads per worker; admission control (config.py) reads the same
+# variable and keeps ADMISSION_MAX_IN_FLIGHT of them running, queues up to
+# SERVER_THREADS - ADMISSION_MAX_IN_FLIGHT - 1 by priority and sheds the rest
+export SERVER_THREADS=${SERVER_THREADS:-12}
+export ADMISSION_MAX_IN_FLIGHT=${ADMISSION_MAX_IN_FLIGHT:-4}
+
 # Run with Gunicorn
 # - workers: 4 (adjust based on CPU cores: 2 * cores + 1)
-# - threads: 2 per worker
-# - Total capacity: 8 concurrent requests minimum
+# - threads: SERVER_THREADS per worker (gthread), 4 running requests and
+#   7 queued by priority each
+# - Total capacity: 16 running requests
 gunicorn \
     --bind 0.0.0.0:5000 \
     --workers 4 \
-    --threads 2 \
-    --worker-class sync \
+    --threads "$SERVER_THREADS" \
+    --worker-class gthread \
     --worker-connections 1000 \
     --max-requests 1000 \
     --max-requests-jitter 100 \
@@ -27,5 +34,5 @@ gunicorn \
     --log-level info \
     wsgi:app
 
-# For high load (100+ students), use:
-# --workers 8 --threads 4
\ No newline at end of file
+# For high load (100+ students), use more workers:
+# --workers 8
\ No newline at end of file
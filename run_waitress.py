@@ -3,6 +3,8 @@ Production server using Waitress (works on Windows, Linux, Mac)
 """
 from waitress import serve
 from wsgi import app
+from app import admission
+from config import Config
 import os
 
 if __name__ == '__main__':
@@ -12,7 +14,8 @@ if __name__ == '__main__':
     print("="*60)
     print("Server: Waitress")
     print("Host: 0.0.0.0:5000")
-    print("Threads: 8")
+    print(f"Threads: {Config.SERVER_THREADS} ({Config.ADMISSION_MAX_IN_FLIGHT} running requests, "
+          f"up to {admission.max_queue} queued by priority)")
     print("Max concurrent students: ~100")
     print("="*60)
     
@@ -23,7 +26,7 @@ if __name__ == '__main__':
         app,
         host='0.0.0.0',
         port=5000,
-        threads=8,              # 8 threads for ~100 concurrent users
+        threads=Config.SERVER_THREADS,  # ADMISSION_MAX_IN_FLIGHT run at once; spare threads hold the priority queue
         channel_timeout=120,     # 2 minutes timeout
         connection_limit=200,    # Max 200 connections
         cleanup_interval=10,     # Cleanup every 10 seconds
@@ -0,0 +1,64 @@
+"""
+Benchmark: JSON text vs packed int8 BLOB for results.answers
+
+Usage: python scripts/bench_answers.py [rows] [questions]
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.answers import encode_answers, decode_answers
+
+def build(path, rows, encode):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE results (id INTEGER PRIMARY KEY, answers TEXT NOT NULL)')
+    conn.executemany('INSERT INTO results (answers) VALUES (?)', (
+        (encode(row),) for row in rows
+    ))
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+def timed(label, fn, repeat=5):
+    best = min(_once(fn) for _ in range(repeat))
+    print(f'  {label:<38} {best * 1000:8.1f} ms')
+    return best
+
+def _once(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_questions = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(42)
+    rows = [[rng.choice([-1, 0, 1, 2, 3]) for _ in range(n_questions)] for _ in range(n_rows)]
+
+    tmp = tempfile.mkdtemp()
+    json_db, packed_db = os.path.join(tmp, 'json.db'), os.path.join(tmp, 'packed.db')
+    json_size = build(json_db, rows, json.dumps)
+    packed_size = build(packed_db, rows, encode_answers)
+
+    print(f'{n_rows} results x {n_questions} answers')
+    print(f'  database size  json: {json_size / 1024:8.0f} KiB   packed: {packed_size / 1024:8.0f} KiB'
+          f'   ({json_size / packed_size:.1f}x smaller)')
+    print(f'  per-row value  json: {len(json.dumps(rows[0]))} B   packed: {len(encode_answers(rows[0]))} B')
+
+    json_values = [r[0] for r in sqlite3.connect(json_db).execute('SELECT answers FROM results')]
+    packed_values = [r[0] for r in sqlite3.connect(packed_db).execute('SELECT answers FROM results')]
+
+    print('decode (values already fetched):')
+    timed('json.loads every row', lambda: [json.loads(v) for v in json_values])
+    timed('packed, lazy wrap (get_results)', lambda: [decode_answers(v) for v in packed_values])
+    timed('packed, full tolist()', lambda: [decode_answers(v).tolist() for v in packed_values])
+
+    print('analytics - count unanswered across all rows:')
+    timed('json.loads + count', lambda: sum(json.loads(v).count(-1) for v in json_values))
+    timed('packed BLOB bytes.count (no decode)', lambda: sum(v.count(b'\xff', 1) for v in packed_values))
@@ -0,0 +1,65 @@
+"""
+Benchmark: full-text question search and large-quiz inserts
+
+Builds a throwaway database with N pool questions, then times search pages
+for common and rare terms and how long creating one large quiz holds the
+write lock (its search triggers index every question in that transaction).
+
+Usage: python scripts/bench_search.py [pool questions] [quiz questions]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import Config
+
+WORDS = ('alpha beta gamma delta python sql join index query table column row value function class '
+         'method loop list tuple dict set string integer float network packet router protocol').split()
+
+def make_question(rng, i):
+    words = ' '.join(rng.choice(WORDS) for _ in range(12))
+    return {'text': f'What is the result of {words} in case {i}?',
+            'options': [' '.join(rng.choice(WORDS) for _ in range(3)) for _ in range(4)],
+            'correct': rng.randrange(4)}
+
+def timed(label, fn, repeat=5):
+    best = min(_once(fn) for _ in range(repeat))
+    print(f'  {label:<44} {best * 1000:8.1f} ms')
+    return best
+
+def _once(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+if __name__ == '__main__':
+    n_pool = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    n_quiz = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    rng = random.Random(42)
+
+    tmp = tempfile.mkdtemp()
+    Config.DATABASE_PATH = os.path.join(tmp, 'bench.db')
+    Config.ARCHIVE_DIR = os.path.join(tmp, 'archives')
+    from models.database import Database
+    db = Database()
+
+    started = time.perf_counter()
+    for start in range(0, n_pool, 10000):
+        db.add_pool_questions('bench', [make_question(rng, i) for i in range(start, min(start + 10000, n_pool))])
+    print(f'{n_pool} pool questions indexed in {time.perf_counter() - started:.1f} s')
+
+    print('create_quiz (write lock held for the whole insert):')
+    for size in (n_quiz // 4, n_quiz):
+        questions = [make_question(rng, i) for i in range(size)]
+        timed(f'{size} questions', lambda: db.create_quiz('bench', questions), repeat=1)
+
+    print('search_questions, one page of 20:')
+    for term in ('what', 'alpha', 'alpha python', 'case 12345', 'nomatchword'):
+        _, cursor, ranked_all = db.search_questions(term)
+        timed(f'{term!r} first page{"" if ranked_all else " (newest batch)"}', lambda: db.search_questions(term))
+        if cursor:
+            from utils.search import decode_cursor
+            timed(f'{term!r} second page', lambda: db.search_questions(term, after=decode_cursor(cursor)))
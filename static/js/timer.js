@@ -1,5 +1,5 @@
 class QuizTimer {
-    constructor(quizId, totalMinutes, displayElementId, onExpireCallback) {
+    constructor(quizId, totalMinutes, displayElementId, onExpireCallback, serverRemainingSeconds = null) {
         this.quizId = quizId;
         this.totalSeconds = totalMinutes * 60;
         this.displayElement = document.getElementById(displayElementId);
@@ -9,6 +9,12 @@ class QuizTimer {
         this.storageKey = `quiz_${quizId}_timer`;
         this.startTimeKey = `quiz_${quizId}_start_time`;
         
+        // The server owns the deadline; align the local start time with it
+        if (serverRemainingSeconds !== null) {
+            const elapsedMs = (this.totalSeconds - serverRemainingSeconds) * 1000;
+            localStorage.setItem(this.startTimeKey, (Date.now() - elapsedMs).toString());
+        }
+        
         // Initialize or restore state
         this.initializeTimer();
     }
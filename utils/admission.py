@@ -0,0 +1,240 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import ClosingIterator
+
+# Priorities, lower is more important
+CRITICAL = 0  # saving answers and submitting the exam
+EXAM = 1      # starting an exam and moving between its questions
+BROWSE = 2    # everything else
+
+PRIORITY_NAMES = {CRITICAL: 'critical', EXAM: 'exam', BROWSE: 'browse'}
+
+ENDPOINT_PRIORITIES = {
+    'quiz.submit_answer': CRITICAL,
+    'quiz.complete': CRITICAL,
+    'quiz.start': EXAM,
+    'quiz.question': EXAM,
+}
+
+# Cheap endpoints that never touch the database
+EXEMPT_ENDPOINTS = {'static', 'media.image', 'media.thumbnail'}
+
+# Client buckets kept per worker before the least recently used are dropped
+MAX_BUCKETS = 10000
+
+class TokenBucket:
+    """capacity tokens, refilled continuously at rate tokens per second"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'event', 'state')
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.event = threading.Event()
+        self.state = 'waiting'
+
+    def key(self):
+        return self.priority, self.seq
+
+class AdmissionControl:
+    """Caps in-flight requests and sheds load by priority.
+
+    At most ADMISSION_MAX_IN_FLIGHT requests run at once. The last
+    ADMISSION_RESERVED_SLOTS are kept for critical requests (saving answers,
+    submitting). Others wait in a bounded queue, best priority first, for at
+    most their queue deadline; when the queue is full a new request displaces
+    the lowest-priority waiter or is itself refused. Each waiter holds a server
+    thread, so the queue is sized from SERVER_THREADS with one thread left
+    over: requests beyond it would otherwise wait unprioritized inside the
+    server, where nothing can shed them. Refused requests get
+    503 + Retry-After instead of timing out together. Endpoints listed in
+    RATE_LIMITS also get a token bucket per client address (429 when empty).
+    Counters are per worker process.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._buckets = OrderedDict()
+        self.in_flight = 0
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'shed_queue_full': 0,
+            'shed_timeout': 0,
+            'shed_evicted': 0,
+            'rate_limited': 0,
+            'max_queue_depth': 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_in_flight = app.config['ADMISSION_MAX_IN_FLIGHT']
+        self.reserved = app.config['ADMISSION_RESERVED_SLOTS']
+        self.max_queue = max(0, app.config['SERVER_THREADS'] - self.max_in_flight - 1)
+        if app.config['ADMISSION_MAX_QUEUE'] is not None:
+            self.max_queue = min(self.max_queue, app.config['ADMISSION_MAX_QUEUE'])
+        self.queue_seconds = {
+            CRITICAL: app.config['ADMISSION_CRITICAL_QUEUE_SECONDS'],
+            EXAM: app.config['ADMISSION_QUEUE_SECONDS'],
+            BROWSE: app.config['ADMISSION_QUEUE_SECONDS'],
+        }
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        self.rate_limits = app.config['RATE_LIMITS']
+        self.url_map = app.url_map
+
+        if app.config['ADMISSION_ENABLED']:
+            if self.max_in_flight >= app.config['SERVER_THREADS']:
+                app.logger.warning('ADMISSION_MAX_IN_FLIGHT (%d) is not below SERVER_THREADS (%d): '
+                                   'requests cannot be queued by priority or shed',
+                                   self.max_in_flight, app.config['SERVER_THREADS'])
+            app.wsgi_app = self._middleware(app.wsgi_app)
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except HTTPException:
+            # 404s, 405s and slash redirects are left to Flask
+            return None
+
+    def _middleware(self, wsgi_app):
+        def middleware(environ, start_response):
+            endpoint = self._endpoint(environ)
+            if endpoint in EXEMPT_ENDPOINTS:
+                return wsgi_app(environ, start_response)
+
+            if environ.get('REQUEST_METHOD') == 'POST' and endpoint in self.rate_limits:
+                wait = self._take_token(endpoint, environ.get('REMOTE_ADDR', ''))
+                if wait:
+                    return self._refuse(start_response, '429 Too Many Requests', wait,
+                                        'Too many requests. Please wait and try again.')
+
+            if not self._acquire(ENDPOINT_PRIORITIES.get(endpoint, BROWSE)):
+                return self._refuse(start_response, '503 Service Unavailable', self.retry_after,
+                                    'The server is busy. Please try again in a few seconds.')
+            try:
+                return ClosingIterator(wsgi_app(environ, start_response), self._release)
+            except BaseException:
+                self._release()
+                raise
+        return middleware
+
+    def _refuse(self, start_response, status, retry_after, message):
+        body = message.encode()
+        start_response(status, [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(max(1, int(retry_after + 0.999)))),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [body]
+
+    def _take_token(self, endpoint, client):
+        capacity, per_seconds = self.rate_limits[endpoint]
+        key = (endpoint, client)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(capacity, capacity / per_seconds)
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take()
+            if wait:
+                self.stats['rate_limited'] += 1
+            return wait
+
+    def _limit(self, priority):
+        return self.max_in_flight if priority == CRITICAL else self.max_in_flight - self.reserved
+
+    def _acquire(self, priority):
+        """Wait for a slot. Returns False if the request was shed."""
+        with self._lock:
+            ahead = any(w.priority <= priority for w in self._waiters)
+            if not ahead and self.in_flight < self._limit(priority):
+                self.in_flight += 1
+                self.stats['admitted'] += 1
+                return True
+
+            if len(self._waiters) >= self.max_queue:
+                worst = max(self._waiters, key=_Waiter.key)
+                if worst.priority <= priority:
+                    self.stats['shed_queue_full'] += 1
+                    return False
+                self._waiters.remove(worst)
+                worst.state = 'evicted'
+                worst.event.set()
+
+            waiter = _Waiter(priority, next(self._seq))
+            self._waiters.append(waiter)
+            self.stats['queued'] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._waiters))
+            # A slot may be free for this waiter even though lower-priority ones are stuck
+            self._dispatch()
+
+        waiter.event.wait(self.queue_seconds[priority])
+
+        with self._lock:
+            if waiter.state == 'admitted':
+                return True
+            if waiter.state == 'evicted':
+                self.stats['shed_evicted'] += 1
+                return False
+            self._waiters.remove(waiter)
+            self.stats['shed_timeout'] += 1
+            return False
+
+    def _dispatch(self):
+        # Hand free slots to the best waiters; called with the lock held
+        while self._waiters:
+            best = min(self._waiters, key=_Waiter.key)
+            if self.in_flight >= self._limit(best.priority):
+                return
+            self._waiters.remove(best)
+            best.state = 'admitted'
+            self.in_flight += 1
+            self.stats['admitted'] += 1
+            best.event.set()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def metrics(self):
+        """Snapshot of this worker's admission counters and queue depth"""
+        with self._lock:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiters:
+                depth[PRIORITY_NAMES[waiter.priority]] += 1
+            return dict(self.stats,
+                        in_flight=self.in_flight,
+                        max_in_flight=self.max_in_flight,
+                        max_queue=self.max_queue,
+                        queue_depth=len(self._waiters),
+                        queue_depth_by_priority=depth,
+                        client_buckets=len(self._buckets))
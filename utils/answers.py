@@ -0,0 +1,62 @@
+import json
+from array import array
+from collections.abc import Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional - only analytics use it
+    np = None
+
+# First byte of every packed answers BLOB
+ANSWERS_FORMAT = 1
+
+def encode_answers(answers):
+    """Pack answers (option indexes, -1 for unanswered) into a versioned int8 BLOB"""
+    return bytes([ANSWERS_FORMAT]) + array('b', answers).tobytes()
+
+def decode_answers(value):
+    """Answers column value -> sequence of ints.
+
+    Packed BLOBs are wrapped without decoding; rows written before the packed
+    format still hold JSON text.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return PackedAnswers(value)
+    return json.loads(value)
+
+class PackedAnswers(Sequence):
+    """Read-only view of a packed answers BLOB, decoded per element on access"""
+
+    def __init__(self, blob):
+        view = memoryview(blob)
+        if not len(view) or view[0] != ANSWERS_FORMAT:
+            raise ValueError(f'Unsupported answers format {view[0] if len(view) else None}')
+        self._blob = blob
+        self._view = view[1:].cast('b')
+
+    def __len__(self):
+        return len(self._view)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._view[index].tolist()
+        return self._view[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f'PackedAnswers({self._view.tolist()})'
+
+    def as_array(self):
+        """Zero-copy int8 memoryview over the BLOB (supports the buffer protocol)"""
+        return self._view
+
+    def to_numpy(self):
+        """Zero-copy NumPy int8 array (requires NumPy)"""
+        if np is None:
+            raise RuntimeError('NumPy is not installed')
+        return np.frombuffer(self._blob, dtype=np.int8, offset=1)
+
+    def tolist(self):
+        return self._view.tolist()
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import sqlite3
+import zlib
+from contextlib import closing
+from utils.answers import decode_answers
+
+ARCHIVE_PATTERN = re.compile(r'^archive-(\d{4}-\d{2})\.db$')
+
+def archive_name(period):
+    """File name of the archive for a 'YYYY-MM' period"""
+    return f'archive-{period}.db'
+
+def _period(timestamp):
+    # SQLite CURRENT_TIMESTAMP values look like 'YYYY-MM-DD HH:MM:SS'
+    return str(timestamp)[:7]
+
+def _pack(rows):
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9)
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data))
+
+class ResultsArchive:
+    """Old results and contact messages, moved out of the main database.
+
+    Each calendar month (by taken_at / created_at) gets its own SQLite file in
+    directory. Rows are stored as zlib-compressed JSON blocks, one block per
+    quiz per archiving batch, so an archive is a fraction of the size the rows
+    took in the main database. Each file also records which IDs it holds, so
+    re-running a batch that was interrupted after the archive was written but
+    before the rows were deleted does not archive them twice.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+
+    def periods(self):
+        """Archived periods, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(m.group(1) for m in map(ARCHIVE_PATTERN.match, os.listdir(self.directory)) if m)
+
+    def _connect(self, period, create=False):
+        path = os.path.join(self.directory, archive_name(period))
+        if not create:
+            return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS result_blocks (
+                id INTEGER PRIMARY KEY,
+                quiz_id INTEGER NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_result_blocks_quiz ON result_blocks(quiz_id, first_id);
+            CREATE TABLE IF NOT EXISTS message_blocks (
+                id INTEGER PRIMARY KEY,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS archived_ids (
+                kind TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (kind, id)
+            ) WITHOUT ROWID;
+        ''')
+        return conn
+
+    def write(self, kind, rows, timestamp_key):
+        """Append rows (dicts with 'id') of kind 'results' or 'messages'.
+
+        Rows already archived by an earlier, interrupted run are skipped.
+        """
+        by_period = {}
+        for row in rows:
+            by_period.setdefault(_period(row[timestamp_key]), []).append(row)
+
+        for period, period_rows in by_period.items():
+            with closing(self._connect(period, create=True)) as conn, conn:
+                new_rows = []
+                for row in sorted(period_rows, key=lambda row: row['id']):
+                    cursor = conn.execute('INSERT OR IGNORE INTO archived_ids (kind, id) VALUES (?, ?)', (kind, row['id']))
+                    if cursor.rowcount == 1:
+                        new_rows.append(row)
+                period_rows = new_rows
+                if not period_rows:
+                    continue
+
+                if kind == 'results':
+                    by_quiz = {}
+                    for row in period_rows:
+                        by_quiz.setdefault(row['quiz_id'], []).append(row)
+                    conn.executemany(
+                        'INSERT INTO result_blocks (quiz_id, first_id, last_id, row_count, data) VALUES (?, ?, ?, ?, ?)',
+                        [(quiz_id, block[0]['id'], block[-1]['id'], len(block), _pack(block))
+                         for quiz_id, block in by_quiz.items()]
+                    )
+                else:
+                    conn.execute(
+                        'INSERT INTO message_blocks (first_id, last_id, row_count, data) VALUES (?, ?, ?, ?)',
+                        (period_rows[0]['id'], period_rows[-1]['id'], len(period_rows), _pack(period_rows))
+                    )
+
+    def iter_results(self, quiz_id=None, newest_first=False):
+        """Yield archived results (answers as lists), optionally for one quiz"""
+        periods = self.periods()
+        for period in reversed(periods) if newest_first else periods:
+            with closing(self._connect(period)) as conn:
+                order = 'DESC' if newest_first else 'ASC'
+                if quiz_id is None:
+                    cursor = conn.execute(f'SELECT data FROM result_blocks ORDER BY last_id {order}')
+                else:
+                    cursor = conn.execute(
+                        f'SELECT data FROM result_blocks WHERE quiz_id = ? ORDER BY first_id {order}', (quiz_id,)
+                    )
+                blocks = [_unpack(row[0]) for row in cursor.fetchall()]
+            rows = [row for block in blocks for row in block]
+            rows.sort(key=lambda row: row['id'], reverse=newest_first)
+            yield from rows
+
+    def iter_messages(self, newest_first=True):
+        """Yield archived contact messages"""
+        periods = self.periods()
+        for period in reversed(periods) if newest_first else periods:
+            with closing(self._connect(period)) as conn:
+                order = 'DESC' if newest_first else 'ASC'
+                blocks = [_unpack(row[0]) for row in
+                          conn.execute(f'SELECT data FROM message_blocks ORDER BY last_id {order}').fetchall()]
+            rows = [row for block in blocks for row in block]
+            rows.sort(key=lambda row: row['id'], reverse=newest_first)
+            yield from rows
+
+def archive_row(row):
+    """sqlite3.Row from the main database -> JSON-safe dict for an archive block"""
+    data = dict(row)
+    if 'answers' in data:
+        data['answers'] = list(decode_answers(data['answers']))
+    return data
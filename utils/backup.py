@@ -0,0 +1,333 @@
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows refuses to delete a file another process has open
+    fcntl = None
+
+BACKUP_PATTERN = re.compile(r'^quiz_app-(\d{8}-\d{6})\.db\.gz$')
+LOCK_NAME = 'backup.lock'
+STALE_LOCK_SECONDS = 6 * 60 * 60
+PROBE_INTERVAL = 0.05  # seconds between writer-stall probes
+WAL_DMS_OFFSET = 128  # -shm byte every connection using the WAL keeps a shared lock on
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def checksum_path(path):
+    """Path of the sha256sum-style checksum file that goes with a backup"""
+    return f'{path}.sha256'
+
+class _WriterProbe:
+    """Times how long a writer waits for the write lock while a backup runs.
+
+    BEGIN IMMEDIATE takes the same lock save_result() needs; rolling back
+    straight away changes nothing, so the probe does not restart the backup.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.waits = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='backup-probe')
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        with closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None)) as conn:
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute('ROLLBACK')
+                except sqlite3.OperationalError:
+                    pass  # timed out: the full wait is still recorded
+                self.waits.append(time.perf_counter() - started)
+                self._stop.wait(PROBE_INTERVAL)
+
+def _online_copy(db_path, target, pages, sleep, max_restarts):
+    """Copy db_path into the SQLite file target with the online backup API.
+
+    The copy runs pages pages per step with a sleep between steps. In WAL
+    mode the source connection holds one read snapshot for the whole copy:
+    writers carry on appending to the WAL, and the copy neither blocks them
+    nor restarts when they commit. Otherwise a commit from another connection
+    restarts the copy, and after max_restarts the rest is copied in one step.
+    """
+    stats = {'steps': 0, 'restarts': 0, 'longest_step_ms': 0.0, 'single_step': False}
+    state = {'remaining': None, 'step_started': time.perf_counter()}
+
+    def progress(status, remaining, total):
+        step = time.perf_counter() - state['step_started']
+        stats['steps'] += 1
+        stats['longest_step_ms'] = max(stats['longest_step_ms'], step * 1000)
+        stats['pages'] = total
+        if state['remaining'] is not None and remaining > state['remaining']:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+        if remaining:
+            time.sleep(sleep)
+        state['step_started'] = time.perf_counter()
+
+    with closing(sqlite3.connect(str(db_path), isolation_level=None)) as source, \
+            closing(sqlite3.connect(target)) as dest:
+        snapshot = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        if snapshot:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        try:
+            source.backup(dest, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            started = time.perf_counter()
+            source.backup(dest)
+            stats['single_step'] = True
+            stats['longest_step_ms'] = max(stats['longest_step_ms'], (time.perf_counter() - started) * 1000)
+        finally:
+            if snapshot:
+                source.execute('COMMIT')
+    return stats
+
+def create_backup(db_path, directory, pages=256, sleep=0.05, max_restarts=5):
+    """Write a compressed, checksummed snapshot of the live database to directory.
+
+    Returns a report with the backup path, sizes, duration, copy steps and
+    the longest and average time a writer waited for its lock meanwhile.
+    """
+    directory = str(directory)
+    os.makedirs(directory, exist_ok=True)
+    lock = _acquire_lock(directory)
+    try:
+        name = f'quiz_app-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.db.gz'
+        path = os.path.join(directory, name)
+        tmp = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+        compressed = f'{tmp}.gz'
+        started = time.perf_counter()
+        try:
+            with _WriterProbe(db_path) as probe:
+                report = _online_copy(db_path, tmp, pages, sleep, max_restarts)
+            copied = time.perf_counter() - started
+
+            with open(tmp, 'rb') as src, gzip.open(compressed, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            report['size'] = os.path.getsize(tmp)
+            os.replace(compressed, path)
+        finally:
+            for leftover in (tmp, compressed):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        with open(checksum_path(path), 'w') as f:
+            f.write(f'{_sha256_file(path)}  {name}\n')
+
+        waits = probe.waits or [0.0]
+        report.update({
+            'path': path,
+            'compressed_size': os.path.getsize(path),
+            'copy_seconds': round(copied, 3),
+            'duration_seconds': round(time.perf_counter() - started, 3),
+            'longest_step_ms': round(report['longest_step_ms'], 1),
+            'max_writer_wait_ms': round(max(waits) * 1000, 1),
+            'avg_writer_wait_ms': round(sum(waits) / len(waits) * 1000, 2),
+        })
+        return report
+    finally:
+        os.close(lock)
+        os.remove(os.path.join(directory, LOCK_NAME))
+
+def _acquire_lock(directory):
+    # One backup at a time across workers and the CLI; a crashed run's lock goes stale
+    lock_path = os.path.join(directory, LOCK_NAME)
+    for _ in range(2):
+        try:
+            return os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) < STALE_LOCK_SECONDS:
+                    break
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    raise RuntimeError('Another backup is already running')
+
+def list_backups(directory):
+    """Backup file paths, newest first"""
+    directory = str(directory)
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if BACKUP_PATTERN.match(name)), reverse=True)
+    return [os.path.join(directory, name) for name in names]
+
+def prune_backups(directory, keep):
+    """Delete all but the newest keep backups. Returns the paths removed."""
+    removed = list_backups(directory)[keep:]
+    for path in removed:
+        for stale in (path, checksum_path(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+    return removed
+
+def verify_backup(path, work_dir):
+    """Check a backup's checksum, decompress it into work_dir and run an integrity check.
+
+    Returns the path of the decompressed database; raises ValueError if the
+    backup is damaged.
+    """
+    try:
+        with open(checksum_path(path)) as f:
+            expected = f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        raise ValueError(f'No checksum file for {os.path.basename(path)}')
+    if _sha256_file(path) != expected:
+        raise ValueError(f'Checksum mismatch for {os.path.basename(path)}')
+
+    restored = os.path.join(str(work_dir), f'.restore-{uuid.uuid4().hex}.db')
+    try:
+        with gzip.open(path, 'rb') as src, open(restored, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        with closing(sqlite3.connect(f'file:{restored}?mode=ro', uri=True)) as conn:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise ValueError(f'Integrity check failed: {result}')
+            conn.execute('SELECT COUNT(*) FROM quizzes').fetchone()
+    except (OSError, EOFError, sqlite3.DatabaseError) as e:
+        os.remove(restored)
+        raise ValueError(f'Backup is not a readable database: {e}')
+    except ValueError:
+        os.remove(restored)
+        raise
+    return restored
+
+class DatabaseInUse(Exception):
+    pass
+
+def _wal_in_use(db_path):
+    """Whether another process has the database's WAL open (always False without fcntl)"""
+    shm = f'{db_path}-shm'
+    if fcntl is None or not os.path.exists(shm):
+        return False
+    with open(shm, 'r+b') as f:
+        try:
+            fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, WAL_DMS_OFFSET)
+        except OSError:
+            return True
+        fcntl.lockf(f, fcntl.LOCK_UN, 1, WAL_DMS_OFFSET)
+    return False
+
+def restore_backup(restored, db_path):
+    """Copy a database checked by verify_backup() over db_path.
+
+    Raises DatabaseInUse, changing nothing, while any other connection (this
+    process's included) is using the database - stop the app first.
+    """
+    db_path = str(db_path)
+    try:
+        with closing(sqlite3.connect(restored)) as source, \
+                closing(sqlite3.connect(db_path, timeout=1, isolation_level=None)) as dest:
+            # Held until dest closes, so nobody can read or write mid-restore
+            dest.execute('PRAGMA locking_mode=EXCLUSIVE')
+            try:
+                dest.execute('BEGIN EXCLUSIVE')
+            except sqlite3.OperationalError as e:
+                raise DatabaseInUse(f'The database is in use ({e})')
+            dest.execute('COMMIT')
+            # Copying through SQLite keeps the target's WAL and shared memory consistent
+            source.backup(dest)
+            dest.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    except DatabaseInUse:
+        raise
+    except sqlite3.DatabaseError:
+        # The current file is too damaged to lock or write into - swap the whole
+        # file instead, but never pull the WAL out from under open connections
+        if _wal_in_use(db_path):
+            raise DatabaseInUse('The damaged database is still open in another process')
+        shutil.copyfile(restored, f'{db_path}.restore')
+        for stale in (f'{db_path}-wal', f'{db_path}-shm'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        os.replace(f'{db_path}.restore', db_path)
+
+class BackupScheduler:
+    """Takes an online backup every BACKUP_INTERVAL_HOURS.
+
+    Backups copy BACKUP_PAGES_PER_STEP pages at a time with
+    BACKUP_STEP_SLEEP_MS pauses, so exams can run meanwhile; the last
+    BACKUP_KEEP are kept. Every worker runs the check, but the age of the
+    newest backup and a lock file in BACKUP_DIR mean only one takes it.
+    """
+
+    def __init__(self, app=None):
+        self._thread = None
+        self.last_report = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.db_path = app.config['DATABASE_PATH']
+        self.directory = str(app.config['BACKUP_DIR'])
+        self.interval = app.config['BACKUP_INTERVAL_HOURS'] * 3600
+        self.keep = app.config['BACKUP_KEEP']
+        self.pages = app.config['BACKUP_PAGES_PER_STEP']
+        self.sleep = app.config['BACKUP_STEP_SLEEP_MS'] / 1000
+        self.max_restarts = app.config['BACKUP_MAX_RESTARTS']
+        self.logger = app.logger
+        self.enabled = app.config['BACKUP_ENABLED']
+
+    def start(self):
+        """Start the backup thread; only serving processes call this (see create_app)"""
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='db-backup')
+            self._thread.start()
+
+    def backup(self, prune=True):
+        """Take a backup now and, if prune, apply retention. Returns the backup report."""
+        report = create_backup(self.db_path, self.directory, self.pages, self.sleep, self.max_restarts)
+        report['pruned'] = len(prune_backups(self.directory, self.keep)) if prune else 0
+        self.last_report = report
+        return report
+
+    def run_once(self, now=None):
+        """Back up if the newest backup is older than the interval. Returns the report or None."""
+        now = now or time.time()
+        backups = list_backups(self.directory)
+        if backups and now - os.path.getmtime(backups[0]) < self.interval:
+            return None
+        return self.backup()
+
+    def _run(self):
+        while True:
+            time.sleep(min(self.interval, 3600))
+            try:
+                report = self.run_once()
+                if report:
+                    self.logger.info('Backup %s: %.1fs, longest step %.1fms, max writer wait %.1fms',
+                                     os.path.basename(report['path']), report['duration_seconds'],
+                                     report['longest_step_ms'], report['max_writer_wait_ms'])
+            except RuntimeError:
+                self.logger.debug('Backup skipped: another backup is running')
+            except Exception:
+                self.logger.exception('Database backup failed')
@@ -0,0 +1,130 @@
+import heapq
+import threading
+import time
+from models.database import Database
+from utils.helpers import calculate_score
+from utils.sampling import attempt_answer_key
+from utils import monitor
+
+def answers_to_list(answers_dict, total):
+    """Convert {"question index": answer} to a list with -1 for unanswered"""
+    return [answers_dict.get(str(i), -1) for i in range(total)]
+
+def score_attempt(db, attempt, quiz_data):
+    """Build the finalize_attempts() entry for an attempt"""
+    answer_key = attempt_answer_key(db, quiz_data, attempt['seed'])
+    answers_list = answers_to_list(attempt['answers'], len(answer_key))
+    score, total, percentage = calculate_score(answers_list, answer_key)
+    return {
+        'attempt_id': attempt['id'],
+        'quiz_id': quiz_data['id'],
+        'quiz_title': quiz_data['title'],
+        'score': score,
+        'total': total,
+        'percentage': percentage,
+        'answers': answers_list
+    }
+
+def finalize_expired(db, attempts):
+    """Score and finalize attempts that ran out of time. Returns how many were saved."""
+    quizzes = {}
+    finalized = []
+    for attempt in attempts:
+        if attempt['quiz_id'] not in quizzes:
+            quizzes[attempt['quiz_id']] = db.get_quiz(attempt['quiz_id'])
+        quiz_data = quizzes[attempt['quiz_id']]
+        if quiz_data:
+            finalized.append(score_attempt(db, attempt, quiz_data))
+
+    saved = db.finalize_attempts(finalized)
+    for item in finalized:
+        if item['attempt_id'] in saved:
+            monitor.publish('complete', item['attempt_id'],
+                            score=item['score'], total=item['total'], percentage=item['percentage'])
+    return len(saved)
+
+class DeadlineScheduler:
+    """Auto-finalizes attempts whose server-side deadline has passed.
+
+    Deadlines sit in a min-heap, so scheduling is O(log n) and the thread only
+    wakes when the earliest one falls due. Due attempts are finalized in
+    batches of DEADLINE_BATCH_SIZE per transaction. On start the heap is
+    rebuilt from the open attempts in the database, and a periodic sweep
+    picks up attempts scheduled by workers that have since exited.
+    Finalization is idempotent, so several workers racing on the same attempt
+    save exactly one result.
+    """
+
+    def __init__(self, app=None):
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.grace = app.config['DEADLINE_GRACE_SECONDS']
+        self.batch_size = app.config['DEADLINE_BATCH_SIZE']
+        self.sweep_interval = app.config['DEADLINE_SWEEP_SECONDS']
+        self.logger = app.logger
+        self.enabled = app.config['DEADLINE_SCHEDULER_ENABLED']
+
+    def start(self):
+        """Start the scheduler thread; only serving processes call this (see create_app)"""
+        if self.enabled and self._thread is None:
+            self.db = Database()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='deadline-scheduler')
+            self._thread.start()
+
+    def schedule(self, attempt_id, deadline):
+        """Finalize attempt_id once deadline (epoch seconds) plus the grace period has passed"""
+        if self._thread is None:
+            return
+        with self._condition:
+            heapq.heappush(self._heap, (deadline + self.grace, attempt_id))
+            if self._heap[0][1] == attempt_id:
+                self._condition.notify()
+
+    def _rebuild(self):
+        entries = [(deadline + self.grace, attempt_id) for attempt_id, deadline in self.db.get_open_attempt_deadlines()]
+        heapq.heapify(entries)
+        with self._condition:
+            for entry in self._heap:
+                heapq.heappush(entries, entry)
+            self._heap = entries
+
+    def _next_batch(self, next_sweep):
+        """Block until attempts are due or a sweep is needed, then pop the due batch"""
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                        batch.append(heapq.heappop(self._heap)[1])
+                    return batch
+                if now >= next_sweep:
+                    return []
+                wake_at = min(self._heap[0][0], next_sweep) if self._heap else next_sweep
+                self._condition.wait(wake_at - now)
+
+    def _run(self):
+        try:
+            self._rebuild()
+        except Exception:
+            self.logger.exception('Could not rebuild attempt deadlines')
+
+        next_sweep = time.time() + self.sweep_interval
+        while True:
+            batch = self._next_batch(next_sweep)
+            try:
+                if batch:
+                    finalize_expired(self.db, self.db.get_open_attempts(batch))
+                else:
+                    next_sweep = time.time() + self.sweep_interval
+                    while True:
+                        expired = self.db.get_expired_attempts(time.time() - self.grace, self.batch_size)
+                        if not expired or finalize_expired(self.db, expired) == 0:
+                            break
+            except Exception:
+                self.logger.exception('Finalizing expired attempts failed')
@@ -0,0 +1,109 @@
+import hashlib
+import random
+import re
+import zlib
+from array import array
+
+# 128 permutations in 16 bands of 8 rows: pairs above ~0.7 Jaccard similarity
+# almost always share a band bucket, pairs below ~0.5 rarely do
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Estimated similarity at or above which a candidate is reported
+DUPLICATE_THRESHOLD = 0.7
+
+SHINGLE_SIZE = 5
+_MASK64 = (1 << 64) - 1
+
+# Multiply-shift hash family h(x) = ((a*x + b) mod 2^64) >> 32. Fixed seed -
+# stored signatures are only comparable while these coefficients never change.
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.getrandbits(64) | 1, _rng.getrandbits(64)) for _ in range(NUM_PERM)]
+
+try:
+    import numpy as np
+    _A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)[:, None]
+    _B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)[:, None]
+except ImportError:  # NumPy is optional - it only speeds up large imports
+    np = None
+
+def normalize(text):
+    """Lowercase, drop punctuation and markup, collapse whitespace"""
+    return ' '.join(re.sub(r'[\W_]+', ' ', str(text).lower()).split())
+
+def shingles(question):
+    """Character shingles of a question's text plus its options (in sorted order)"""
+    text = ' '.join([normalize(question['text'])] + sorted(normalize(o) for o in question['options']))
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def minhash(question):
+    """MinHash signature of a question as array('I') of NUM_PERM values"""
+    hashes = [zlib.crc32(s.encode()) for s in shingles(question)]
+    if np is not None:
+        with np.errstate(over='ignore'):  # uint64 wraparound is the mod 2^64
+            values = (_A * np.array(hashes, dtype=np.uint64) + _B) >> np.uint64(32)
+        return array('I', values.min(axis=1).tolist())
+    return array('I', [min(((a * h + b) & _MASK64) >> 32 for h in hashes) for a, b in _PERMUTATIONS])
+
+def band_buckets(signature):
+    """(band, bucket) keys for the LSH index - one per band of ROWS values"""
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        keys.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return keys
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+def find_duplicates(db, questions):
+    """Likely duplicates of each new question among stored questions and the batch itself.
+
+    Candidates come from shared LSH band buckets, so the cost depends on the
+    number of near matches rather than on the size of the question bank.
+    Returns (signatures, duplicates) where duplicates is a list of
+    (question index, [match, ...]) and each match has 'label' and 'similarity'.
+    """
+    signatures = [minhash(q) for q in questions]
+    duplicates = []
+    batch_buckets = {}
+
+    for index, signature in enumerate(signatures):
+        buckets = band_buckets(signature)
+        matches = []
+
+        for candidate in db.find_signature_candidates(buckets):
+            score = similarity(signature, candidate['signature'])
+            if score >= DUPLICATE_THRESHOLD:
+                matches.append({'label': candidate['label'], 'similarity': score})
+
+        seen = set()
+        for key in buckets:
+            for other in batch_buckets.get(key, ()):
+                if other in seen:
+                    continue
+                seen.add(other)
+                score = similarity(signature, signatures[other])
+                if score >= DUPLICATE_THRESHOLD:
+                    matches.append({'label': f'question {other + 1} of this upload', 'similarity': score})
+            batch_buckets.setdefault(key, []).append(index)
+
+        if matches:
+            matches.sort(key=lambda m: m['similarity'], reverse=True)
+            duplicates.append((index, matches))
+
+    return signatures, duplicates
+
+def describe_duplicates(duplicates, limit=5):
+    """One-line summary of find_duplicates() output for a flash message"""
+    parts = []
+    for index, matches in duplicates[:limit]:
+        best = matches[0]
+        parts.append(f'Q{index + 1} ~ {best["label"]} ({best["similarity"]:.0%})')
+    more = f' and {len(duplicates) - limit} more' if len(duplicates) > limit else ''
+    return f'Possible duplicate questions: {"; ".join(parts)}{more}'
@@ -16,8 +16,8 @@ def render_markdown(text):
     if has_html_tags and not any(marker in text for marker in ['**', '*', '#', '`', '[', ']']):
         return f'<code>{html_module.escape(text)}</code>'
     
-    # If it contains code blocks, process with markdown
-    if '```' in text or '`' in text:
+    # If it contains code blocks or images, process with markdown
+    if '```' in text or '`' in text or '![' in text:
         md = markdown.Markdown(
             extensions=[
                 'fenced_code',
@@ -37,14 +37,14 @@ def render_markdown(text):
     # Replace newlines with <br> tags
     return text.replace('\n', '<br>')
 
-def calculate_score(answers, questions):
-    """Calculate quiz score"""
-    if not answers or not questions:
+def calculate_score(answers, answer_key):
+    """Calculate quiz score from the correct option index of each question"""
+    if not answers or not answer_key:
         return 0, 0, 0
     
     score = sum(1 for i, ans in enumerate(answers) 
-                if i < len(questions) and ans == questions[i]['correct'])
-    total = len(questions)
+                if i < len(answer_key) and ans == answer_key[i])
+    total = len(answer_key)
     percentage = round((score / total) * 100, 1) if total > 0 else 0
     
     return score, total, percentage
@@ -0,0 +1,47 @@
+import json
+
+# Fixed-width percentage buckets: [0, 10), [10, 20), ... [90, 100]
+BUCKET_COUNT = 10
+BUCKET_WIDTH = 100 // BUCKET_COUNT
+
+def empty_buckets():
+    """JSON text of an all-zero percentage histogram"""
+    return json.dumps([0] * BUCKET_COUNT)
+
+def percentage_bucket(percentage):
+    """Index of the bucket a percentage falls in"""
+    return min(max(int(percentage // BUCKET_WIDTH), 0), BUCKET_COUNT - 1)
+
+def build_histogram(rows):
+    """Histogram dict from (score, percentage, count) rows"""
+    buckets = [0] * BUCKET_COUNT
+    scores = {}
+    for score, percentage, count in rows:
+        buckets[percentage_bucket(percentage)] += count
+        scores[str(score)] = scores.get(str(score), 0) + count
+    return {'results': sum(buckets), 'percentage_buckets': buckets, 'score_counts': scores}
+
+def percentile_rank(histogram, score):
+    """Share of results (0-100) scoring below score, counting ties as half"""
+    if not histogram or not histogram['results']:
+        return None
+    below = sum(count for s, count in histogram['score_counts'].items() if int(s) < score)
+    equal = histogram['score_counts'].get(str(score), 0)
+    return round(100 * (below + equal / 2) / histogram['results'])
+
+def distribution(histogram, percentage):
+    """Bars for the class distribution chart; the student's bucket is marked"""
+    if not histogram or not histogram['results']:
+        return []
+    buckets = histogram['percentage_buckets']
+    tallest = max(buckets) or 1
+    mine = percentage_bucket(percentage)
+    bars = []
+    for i, count in enumerate(buckets):
+        low = i * BUCKET_WIDTH
+        high = 100 if i == BUCKET_COUNT - 1 else low + BUCKET_WIDTH - 1
+        bars.append({'label': f'{low}-{high}%',
+                     'count': count,
+                     'height': round(100 * count / tallest),
+                     'mine': i == mine})
+    return bars
@@ -0,0 +1,67 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from models.database import Database
+
+def archive_cutoff(days):
+    """'YYYY-MM-DD HH:MM:SS' UTC timestamp days ago, comparable with CURRENT_TIMESTAMP"""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+class MaintenanceScheduler:
+    """Background database upkeep, run only while no exam is in progress.
+
+    Every MAINTENANCE_INTERVAL_SECONDS, unless some attempt is still running,
+    it checkpoints and truncates the WAL and returns up to
+    VACUUM_PAGES_PER_RUN free pages to the filesystem with an incremental
+    vacuum. Every ARCHIVE_INTERVAL_HOURS it also moves results older than
+    ARCHIVE_AFTER_DAYS to the archives; the last archive time is kept in the
+    database, so recycled or restarted workers don't reset the schedule.
+    Skipped work is retried on the next tick, so checkpoints and vacuuming
+    land between exams.
+    """
+
+    def __init__(self, app=None):
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.interval = app.config['MAINTENANCE_INTERVAL_SECONDS']
+        self.vacuum_pages = app.config['VACUUM_PAGES_PER_RUN']
+        self.archive_days = app.config['ARCHIVE_AFTER_DAYS']
+        self.archive_interval = app.config['ARCHIVE_INTERVAL_HOURS'] * 3600
+        self.logger = app.logger
+        self.enabled = app.config['MAINTENANCE_ENABLED']
+
+    def start(self):
+        """Start the maintenance thread; only serving processes call this (see create_app)"""
+        if self.enabled and self._thread is None:
+            self.db = Database()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='db-maintenance')
+            self._thread.start()
+
+    def run_once(self, now=None):
+        """One maintenance pass. Returns what was done, or None if an exam is running."""
+        now = now or time.time()
+        if self.db.has_active_attempts(now):
+            return None
+
+        done = {}
+        if self.archive_days and now - self.db.last_maintenance_run('archive') >= self.archive_interval:
+            done['archived'] = self.db.archive_old_rows(archive_cutoff(self.archive_days))
+            self.db.record_maintenance_run('archive', now)
+        done['checkpoint'] = self.db.checkpoint()
+        done['free_pages'] = self.db.incremental_vacuum(self.vacuum_pages)
+        return done
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                done = self.run_once()
+                if done is None:
+                    self.logger.debug('Database maintenance skipped: exam in progress')
+                elif done.get('archived'):
+                    self.logger.info('Archived old rows: %s', done['archived'])
+            except Exception:
+                self.logger.exception('Database maintenance failed')
@@ -0,0 +1,155 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import uuid
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is in requirements.txt - this only keeps uploads working if it failed to install
+    Image = None
+
+MEDIA_URL = '/media'
+
+# Stored file names are the SHA-256 of the content plus the detected type
+NAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.(png|jpg|gif|webp)$')
+
+MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
+PIL_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'gif': 'GIF', 'webp': 'WEBP'}
+
+# ![alt](src) - src may be a data URI, an uploaded file name or a URL
+IMAGE_REF = re.compile(r'!\[([^\]]*)\]\(\s*([^)\s]+)\s*\)')
+DATA_URI = re.compile(r'^data:image/[\w.+-]+;base64,(.*)$', re.DOTALL)
+
+def detect_image_type(data):
+    """File extension for PNG/JPEG/GIF/WebP data from its magic bytes, else None.
+
+    SVG is deliberately not accepted - it can carry scripts.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+class MediaStore:
+    """Content-addressed image store on the local filesystem.
+
+    An image is saved once under the SHA-256 of its bytes, so uploading the
+    same picture again (in another quiz or pool) costs nothing. Files live in
+    MEDIA_DIR/<first two hex digits>/<sha256>.<ext>; a thumbnail no larger
+    than MEDIA_THUMBNAIL_SIZE is generated once at upload with Pillow.
+    Questions only hold the hashed URLs, and the files never
+    change, so they can be cached forever.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = str(app.config['MEDIA_DIR'])
+        self.max_bytes = app.config['MEDIA_MAX_BYTES']
+        self.thumbnail_size = app.config['MEDIA_THUMBNAIL_SIZE']
+        self.logger = app.logger
+
+    def path(self, name, thumbnail=False):
+        """Filesystem path of a stored image or its thumbnail"""
+        parts = [self.directory, 'thumbs'] if thumbnail else [self.directory]
+        return os.path.join(*parts, name[:2], name)
+
+    def url(self, name, thumbnail=False):
+        return f'{MEDIA_URL}/thumbs/{name}' if thumbnail else f'{MEDIA_URL}/{name}'
+
+    def store(self, data):
+        """Save image bytes if not already stored. Returns the stored file name."""
+        if len(data) > self.max_bytes:
+            raise ValueError(f'Image is larger than {self.max_bytes // (1024 * 1024)}MB')
+        ext = detect_image_type(data)
+        if ext is None:
+            raise ValueError('Only PNG, JPEG, GIF and WebP images are supported')
+
+        name = f'{hashlib.sha256(data).hexdigest()}.{ext}'
+        path = self.path(name)
+        if not os.path.exists(path):
+            _atomic_write(path, data)
+            self._make_thumbnail(name, data)
+        return name
+
+    def _make_thumbnail(self, name, data):
+        if Image is None:
+            self.logger.warning('Pillow is not installed - no thumbnail for %s', name)
+            return
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if max(image.size) <= self.thumbnail_size:
+                    return
+                image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                buffer = io.BytesIO()
+                image.save(buffer, PIL_FORMATS[name.rsplit('.', 1)[1]])
+        except Exception:
+            # A picture Pillow can't read is still served, just without a thumbnail
+            self.logger.warning('Could not create a thumbnail for %s', name)
+            return
+        _atomic_write(self.path(name, thumbnail=True), buffer.getvalue())
+
+    def image_markdown(self, alt, name):
+        """Markdown for a stored image - its thumbnail linking to the full size if there is one"""
+        if os.path.exists(self.path(name, thumbnail=True)):
+            return f'[![{alt}]({self.url(name, thumbnail=True)})]({self.url(name)})'
+        return f'![{alt}]({self.url(name)})'
+
+    def rewrite_text(self, text, files):
+        """Store inline data URIs and images named in files, pointing their references at hashed URLs.
+
+        files maps uploaded file names to their bytes. Returns (text, images stored).
+        """
+        stored = 0
+
+        def replace(match):
+            nonlocal stored
+            alt, src = match.groups()
+            data_uri = DATA_URI.match(src)
+            if data_uri:
+                try:
+                    data = base64.b64decode(data_uri.group(1), validate=False)
+                except (binascii.Error, ValueError):
+                    raise ValueError(f'Invalid inline image in "{alt or src[:30]}"')
+            elif os.path.basename(src) in files:
+                data = files[os.path.basename(src)]
+            else:
+                # External links and already hashed URLs are left alone
+                return match.group(0)
+            stored += 1
+            return self.image_markdown(alt, self.store(data))
+
+        return IMAGE_REF.sub(replace, text), stored
+
+    def rewrite_questions(self, questions, files=None):
+        """rewrite_text() over every question's text and options. Returns images stored."""
+        files = files or {}
+        stored = 0
+        for question in questions:
+            question['text'], count = self.rewrite_text(question['text'], files)
+            stored += count
+            options = []
+            for option in question['options']:
+                if isinstance(option, str):
+                    option, count = self.rewrite_text(option, files)
+                    stored += count
+                options.append(option)
+            question['options'] = options
+        return stored
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from config import Config
+from models.database import Database
+
+TOKEN_SALT = 'exam-monitor'
+
+# Finished or abandoned attempts are dropped from the live view after this long
+RETAIN_SECONDS = 6 * 60 * 60
+
+# SSE comment sent on idle streams so proxies don't close them
+HEARTBEAT_SECONDS = 15
+
+_publish_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+_publish_socket.setblocking(False)
+
+def publish(event, attempt_id, **data):
+    """Send a progress event to the monitor hub.
+
+    Events are fire-and-forget UDP datagrams on loopback, so publishing from a
+    request never blocks and works from every gunicorn worker regardless of
+    which process hosts the hub. Lost events are simply superseded by the next.
+    """
+    if not Config.MONITOR_ENABLED or not attempt_id:
+        return
+    payload = dict(data, event=event, attempt=attempt_id, at=time.time())
+    try:
+        _publish_socket.sendto(json.dumps(payload).encode(), ('127.0.0.1', Config.MONITOR_PORT))
+    except OSError:
+        pass
+
+def make_stream_token(secret_key):
+    """Signed token that lets an admin's browser open the event stream"""
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps('admin')
+
+class _Subscriber:
+    """One connected browser; updates are merged until the stream writer catches up"""
+
+    def __init__(self):
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, states):
+        self.pending.update(states)
+        self.ready.set()
+
+    def take(self):
+        states, self.pending = self.pending, {}
+        self.ready.clear()
+        return states
+
+class _EventProtocol(asyncio.DatagramProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+
+    def datagram_received(self, data, addr):
+        try:
+            self.hub.apply(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            pass
+
+class MonitorHub:
+    """Live exam progress hub streamed to admins over Server-Sent Events.
+
+    Runs its own asyncio loop in a daemon thread, so each connected admin costs
+    a socket and a coroutine rather than a waitress thread or gunicorn worker.
+    Events arrive over UDP from the quiz routes, are folded into per-attempt
+    state and broadcast at most once per MONITOR_COALESCE_MS. The state is
+    rebuilt from the attempts table when the hub starts, so a recycled worker
+    handing the hub to another process doesn't lose running attempts.
+    """
+
+    def __init__(self, app=None):
+        self.attempts = {}
+        self.dirty = set()
+        self.subscribers = set()
+        self.loop = None
+        self._quizzes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=TOKEN_SALT)
+        self.token_max_age = app.config['MONITOR_TOKEN_MAX_AGE']
+        self.coalesce = app.config['MONITOR_COALESCE_MS'] / 1000
+        self.enabled = app.config['MONITOR_ENABLED']
+        self.host = app.config['MONITOR_HOST']
+        self.port = app.config['MONITOR_PORT']
+        self.allowed_origins = set(app.config['MONITOR_ALLOWED_ORIGINS'])
+        self.logger = app.logger
+
+    def start(self):
+        """Bind the monitor port and start the hub; only serving processes call this (see create_app)"""
+        if not self.enabled or self.loop is not None:
+            return
+
+        # Only one process per host can own the port; the others just publish
+        try:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.bind(('127.0.0.1', self.port))
+            tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcp.bind((self.host, self.port))
+        except OSError:
+            self.logger.info('Exam monitor hub already running in another process')
+            return
+
+        self.db = Database()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self._run, args=(udp, tcp), daemon=True, name='exam-monitor').start()
+        self.logger.info(f'Exam monitor streaming on port {self.port}')
+
+    def _run(self, udp, tcp):
+        asyncio.set_event_loop(self.loop)
+        self.changed = asyncio.Event()
+        try:
+            for attempt in self.db.get_monitor_attempts(since=time.time() - RETAIN_SECONDS):
+                self._load(attempt)
+        except Exception:
+            self.logger.exception('Could not load running attempts into the exam monitor')
+        self.loop.run_until_complete(self.loop.create_datagram_endpoint(lambda: _EventProtocol(self), sock=udp))
+        self.loop.run_until_complete(asyncio.start_server(self._handle_client, sock=tcp))
+        self.loop.create_task(self._flush_loop())
+        self.loop.run_forever()
+
+    def _quiz(self, quiz_id):
+        if quiz_id not in self._quizzes:
+            self._quizzes[quiz_id] = self.db.get_quiz(quiz_id)
+        return self._quizzes[quiz_id]
+
+    def _load(self, attempt):
+        """Live state for an attempt read from the database"""
+        quiz = self._quiz(attempt['quiz_id'])
+        if quiz is None:
+            return None
+        state = {'attempt': attempt['id'], 'quiz_id': quiz['id'], 'quiz_title': quiz['title'],
+                 'total': quiz['question_count'], 'deadline': attempt['deadline'],
+                 'started': attempt['started_at'], 'status': 'in_progress',
+                 'answered': len(attempt['answers']), 'current': attempt['current_position'],
+                 'updated': attempt['finalized_at'] or attempt['started_at']}
+        if attempt['finalized_at'] is not None and attempt['score'] is not None:
+            state.update(status='submitted', score=attempt['score'], total=attempt['total'],
+                         percentage=attempt['percentage'], submitted=attempt['finalized_at'])
+        elif attempt['finalized_at'] is not None:
+            state['status'] = 'restarted'
+        self.attempts[attempt['id']] = state
+        return state
+
+    def apply(self, event):
+        """Fold one published event into the attempt's current state"""
+        attempt_id = event['attempt']
+        kind = event['event']
+        state = self.attempts.get(attempt_id)
+        if state is None:
+            if kind == 'start':
+                state = self.attempts[attempt_id] = {'attempt': attempt_id, 'answered': 0, 'current': 0}
+            else:
+                # Started before this hub did and not seen since - a single primary key lookup
+                found = self.db.get_monitor_attempts(attempt_id=attempt_id)
+                state = self._load(found[0]) if found else None
+                if state is None:
+                    return
+
+        if kind == 'start':
+            state.update(quiz_id=event['quiz_id'], quiz_title=event['quiz_title'], total=event['total'],
+                         deadline=event['deadline'], started=event['at'], status='in_progress',
+                         answered=0, current=0)
+        elif kind == 'answer':
+            state.update(current=event['current'], answered=event['answered'])
+        elif kind == 'complete':
+            state.update(status='submitted', score=event['score'], total=event['total'],
+                         percentage=event['percentage'], submitted=event['at'])
+        elif kind == 'restart':
+            state['status'] = 'restarted'
+        state['updated'] = event['at']
+
+        self.dirty.add(attempt_id)
+        self.changed.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self.changed.wait()
+            # Let a burst of answers pile up into one broadcast
+            await asyncio.sleep(self.coalesce)
+            self.changed.clear()
+
+            cutoff = time.time() - RETAIN_SECONDS
+            for attempt_id in [a for a, s in self.attempts.items() if s['updated'] < cutoff]:
+                del self.attempts[attempt_id]
+                self.dirty.discard(attempt_id)
+
+            states = {a: self.attempts[a] for a in self.dirty if a in self.attempts}
+            self.dirty.clear()
+            for subscriber in self.subscribers:
+                subscriber.push(states)
+
+    def _authorized(self, target):
+        token = parse_qs(urlsplit(target).query).get('token', [''])[0]
+        try:
+            self.serializer.loads(token, max_age=self.token_max_age)
+            return True
+        except (BadSignature, SignatureExpired):
+            return False
+
+    def _allowed_origin(self, headers):
+        """The Origin to allow cross-origin reads from, or None.
+
+        MONITOR_ALLOWED_ORIGINS if set; otherwise only the app's own pages,
+        served from the same host name on the app's port.
+        """
+        origin = headers.get('origin')
+        if not origin:
+            return None
+        if self.allowed_origins:
+            return origin if origin in self.allowed_origins else None
+        same_host = urlsplit(origin).hostname == urlsplit(f"//{headers.get('host', '')}").hostname
+        return origin if same_host else None
+
+    async def _handle_client(self, reader, writer):
+        subscriber = None
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET' or urlsplit(parts[1]).path != '/events':
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            if not self._authorized(parts[1]):
+                writer.write(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            origin = self._allowed_origin(headers)
+            cors = f'Access-Control-Allow-Origin: {origin}\r\nVary: Origin\r\n'.encode('latin-1') if origin else b''
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\n' + cors +
+                         b'Connection: keep-alive\r\n\r\n')
+            writer.write(self._format('snapshot', list(self.attempts.values())))
+            await writer.drain()
+
+            subscriber = _Subscriber()
+            self.subscribers.add(subscriber)
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), timeout=HEARTBEAT_SECONDS)
+                    writer.write(self._format('update', list(subscriber.take().values())))
+                except asyncio.TimeoutError:
+                    writer.write(b': ping\n\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            if subscriber is not None:
+                self.subscribers.discard(subscriber)
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _format(event, data):
+        return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
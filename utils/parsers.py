@@ -162,4 +162,29 @@ def validate_questions(questions):
         if q['correct'] < 0 or q['correct'] >= len(q['options']):
             return False, f"Question {q_num} has invalid correct answer index {q['correct']} (only {len(q['options'])} options)"
     
-    return True, None
\ No newline at end of file
+    return True, None
+
+def parse_pool_draws(text):
+    """Parse "pool-name:count, other-pool:count" into a list of (name, count).
+
+    Each pool may appear once - draws are sampled independently, so two draws
+    from one pool could repeat a question within an attempt.
+    """
+    draws = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, count = part.rpartition(':')
+        if not sep or not name.strip():
+            raise ValueError(f"Pool draw '{part}' must look like pool-name:count")
+        try:
+            count = int(count)
+        except ValueError:
+            raise ValueError(f"Pool draw '{part}' has an invalid count")
+        if count < 1:
+            raise ValueError(f"Pool draw '{part}' must draw at least 1 question")
+        if any(existing == name.strip() for existing, _ in draws):
+            raise ValueError(f"Pool '{name.strip()}' is listed more than once - draw its total count in one entry")
+        draws.append((name.strip(), count))
+    return draws
@@ -0,0 +1,288 @@
+import cProfile
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import request, session, before_render_template, template_rendered
+from config import Config
+
+_local = threading.local()
+
+# Statements worth asking the query planner about
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+def current_trace():
+    """Return the trace for the request running on this thread, if any"""
+    return getattr(_local, 'trace', None)
+
+def trace_statement(sql):
+    """Record executed SQL on the active request trace"""
+    trace = current_trace()
+    if trace is not None:
+        trace.record_statement(sql)
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that records each statement's SQL text, with placeholders, on the request trace.
+
+    Unlike a sqlite3 trace callback this never expands bound values: nothing
+    extra is built when no trace is active, submitted data stays out of the
+    slow log, and repeats of one statement group together.
+    """
+
+    def execute(self, sql, parameters=()):
+        trace_statement(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        trace_statement(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        trace_statement(sql_script)
+        return super().executescript(sql_script)
+
+class TracedConnection(sqlite3.Connection):
+    """Connection factory whose cursors (and shortcut execute methods) are TracedCursors"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+def _placeholder_count(sql):
+    # ? placeholders outside string literals and quoted identifiers
+    return re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", '', sql).count('?')
+
+class RequestTrace:
+    """Statements and phase timings collected while serving one request"""
+    MAX_STATEMENTS = 500
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.statements = []
+        self.dropped_statements = 0
+        self.phases = Counter()
+        self.render_started = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record_statement(self, sql):
+        if len(self.statements) >= self.MAX_STATEMENTS:
+            self.dropped_statements += 1
+            return
+        self.statements.append((round(self.elapsed() * 1000, 3), sql))
+
+    def add_phase(self, name, seconds):
+        self.phases[name] += seconds
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval.
+
+    Produces collapsed stacks ("a;b;c count") that flamegraph.pl and
+    speedscope read directly.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+class RequestProfiler:
+    """On-demand request profiler and slow-request log.
+
+    Admins can profile a single request by adding ?_profile=1 or the
+    X-Profile: 1 header; this writes a .pstats file and a collapsed-stack
+    file for flamegraphs. Any request slower than SLOW_REQUEST_MS writes a
+    JSON report with its SQL statements, their query plans and per-phase
+    timings. Output goes to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.output_dir = str(app.config['PROFILE_DIR'])
+        self.slow_ms = app.config['SLOW_REQUEST_MS']
+        self.max_files = app.config['PROFILE_MAX_FILES']
+        self.sample_interval = app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000
+        self.db_path = Config.DATABASE_PATH
+        self._write_lock = threading.Lock()
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def _wants_profile(self):
+        flag = request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+        return flag and session.get('admin')
+
+    def _before_request(self):
+        trace = RequestTrace(request.endpoint or request.path)
+        _local.trace = trace
+
+        if self._wants_profile():
+            trace.profile = cProfile.Profile()
+            trace.sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            trace.sampler.start()
+            trace.profile.enable()
+
+    def _after_request(self, response):
+        trace = current_trace()
+        if trace is None:
+            return response
+        _local.trace = None
+
+        elapsed = trace.elapsed()
+        profile = getattr(trace, 'profile', None)
+        if profile is not None:
+            profile.disable()
+            trace.sampler.stop()
+            response.headers['X-Profile-Id'] = self._write_profile(trace)
+
+        if elapsed * 1000 >= self.slow_ms:
+            try:
+                self._write_slow_report(trace, elapsed, response.status_code)
+            except Exception:
+                # The slow log must never turn a slow response into a failed one
+                pass
+
+        return response
+
+    def _teardown_request(self, exc=None):
+        # after_request is skipped on unhandled errors - don't leak the trace
+        trace = current_trace()
+        if trace is not None:
+            profile = getattr(trace, 'profile', None)
+            if profile is not None:
+                profile.disable()
+                trace.sampler.stop()
+            _local.trace = None
+
+    def _before_render(self, sender, template, context, **extra):
+        trace = current_trace()
+        if trace is not None:
+            trace.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        trace = current_trace()
+        if trace is not None and trace.render_started is not None:
+            trace.add_phase('render', time.perf_counter() - trace.render_started)
+            trace.render_started = None
+
+    def _base_name(self, trace):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        endpoint = trace.endpoint.replace('/', '_').replace('.', '-')
+        return f'{stamp}-{endpoint}-{uuid.uuid4().hex[:8]}'
+
+    def _write_profile(self, trace):
+        """Write .pstats and collapsed-stack output, return the profile id"""
+        name = self._base_name(trace)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        trace.profile.dump_stats(os.path.join(self.output_dir, f'{name}.pstats'))
+        with open(os.path.join(self.output_dir, f'{name}.collapsed'), 'w') as f:
+            f.write(trace.sampler.collapsed())
+
+        self._rotate()
+        return name
+
+    def _explain(self, statements):
+        """Run EXPLAIN QUERY PLAN for each distinct statement on a read-only connection"""
+        plans = {}
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+        try:
+            for _, sql in statements:
+                if sql in plans or not sql.lstrip().upper().startswith(EXPLAINABLE):
+                    continue
+                try:
+                    # Parameters are not recorded; NULLs are enough for the planner
+                    rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', [None] * _placeholder_count(sql)).fetchall()
+                    plans[sql] = [row[3] for row in rows]
+                except sqlite3.Error as e:
+                    plans[sql] = [f'error: {e}']
+        finally:
+            conn.close()
+        return plans
+
+    def _write_slow_report(self, trace, elapsed, status_code):
+        phases = {name: round(seconds * 1000, 3) for name, seconds in trace.phases.items()}
+        phases['app'] = round(elapsed * 1000 - sum(phases.values()), 3)
+        phases['total'] = round(elapsed * 1000, 3)
+
+        plans = self._explain(trace.statements)
+        counts = Counter(sql for _, sql in trace.statements)
+
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': trace.endpoint,
+            'status': status_code,
+            'phases_ms': phases,
+            'statement_count': len(trace.statements) + trace.dropped_statements,
+            'statements': [{
+                'at_ms': at_ms,
+                'sql': sql,
+                'repeats': counts[sql],
+                'plan': plans.get(sql, [])
+            } for at_ms, sql in trace.statements]
+        }
+
+        name = self._base_name(trace)
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, f'{name}.slow.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self._rotate()
+
+    def _rotate(self):
+        """Keep only the newest max_files files in the output directory"""
+        with self._write_lock:
+            entries = [e for e in os.scandir(self.output_dir) if e.is_file()]
+            if len(entries) <= self.max_files:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_files]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
@@ -0,0 +1,266 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from collections.abc import Sequence
+from models.database import Database
+from utils.helpers import render_markdown
+
+MAGIC = b'QFS1'
+FORMAT_VERSION = 1
+POINTER_FILE = 'CURRENT'
+
+# magic, format version, reserved, quiz count, max quiz id, fingerprint (count, max id)
+HEADER = struct.Struct('<4sHHIIQQ')
+QUIZ_OFFSET = struct.Struct('<Q')
+U32 = struct.Struct('<I')
+RECORD = struct.Struct('<QI')  # offset, length
+
+# Quiz fields kept in the store besides the questions themselves
+META_KEYS = ('id', 'title', 'question_count', 'pool_draws', 'shuffle_questions',
+             'shuffle_options', 'timer_minutes', 'created_at')
+
+# Old store files kept around for workers that haven't switched yet
+KEEP_FILES = 3
+
+def compile_question(question):
+    """Question dict with its markdown pre-rendered to HTML"""
+    return dict(question,
+                text_html=render_markdown(question['text']),
+                options_html=[render_markdown(option) for option in question['options']])
+
+def store_fingerprint(db):
+    """(quiz count, max quiz id) - changes whenever a quiz is created or deleted"""
+    with db.get_connection() as conn:
+        row = conn.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM quizzes').fetchone()
+        return row[0], row[1]
+
+def write_store(directory, quizzes, fingerprint, previous=None, copy_ids=()):
+    """Write a new immutable store file and point CURRENT at it. Returns the file name.
+
+    quizzes are compiled from scratch; the quizzes in copy_ids are copied byte
+    for byte from previous, an open _MappedStore.
+    """
+    max_id = max([quiz['id'] for quiz in quizzes] + list(copy_ids), default=0)
+    index_start = HEADER.size
+    data = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(quizzes) + len(copy_ids), max_id, *fingerprint))
+    data += bytes(QUIZ_OFFSET.size * (max_id + 1))
+
+    for quiz_id in copy_ids:
+        QUIZ_OFFSET.pack_into(data, index_start + quiz_id * QUIZ_OFFSET.size, len(data))
+        previous.copy_quiz(quiz_id, data)
+
+    for quiz in quizzes:
+        QUIZ_OFFSET.pack_into(data, index_start + quiz['id'] * QUIZ_OFFSET.size, len(data))
+
+        meta = json.dumps({key: quiz[key] for key in META_KEYS}).encode()
+        records = [json.dumps(compile_question(q)).encode() for q in quiz['questions']]
+
+        data += U32.pack(len(meta)) + meta
+        data += U32.pack(len(records))
+        data += bytes((q['correct'] & 0xFF) for q in quiz['questions'])  # answer key, int8
+
+        table_start = len(data)
+        data += bytes(RECORD.size * len(records))
+        for i, record in enumerate(records):
+            RECORD.pack_into(data, table_start + i * RECORD.size, len(data), len(record))
+            data += record
+
+    os.makedirs(directory, exist_ok=True)
+    name = f'quizzes-{time.time_ns()}-{uuid.uuid4().hex[:6]}.qfs'
+    _atomic_write(os.path.join(directory, name), data)
+    _atomic_write(os.path.join(directory, POINTER_FILE), name.encode())
+
+    # Unlinking is safe for workers still mapping an old file
+    old = sorted(f for f in os.listdir(directory) if f.endswith('.qfs') and f != name)
+    for stale in old[:max(0, len(old) - (KEEP_FILES - 1))]:
+        try:
+            os.remove(os.path.join(directory, stale))
+        except OSError:
+            pass
+    return name
+
+def _atomic_write(path, data):
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class CompiledQuestions(Sequence):
+    """Lazy, read-only view of one quiz's questions inside a mapped store file"""
+
+    def __init__(self, buf, key_offset, table_offset, count):
+        self._buf = buf
+        self._key_offset = key_offset
+        self._table_offset = table_offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('question index out of range')
+        offset, length = RECORD.unpack_from(self._buf, self._table_offset + index * RECORD.size)
+        return json.loads(bytes(self._buf[offset:offset + length]))
+
+    def answer_key(self):
+        """Correct option index per question, read straight from the mapping"""
+        return self._buf[self._key_offset:self._key_offset + self._count].cast('b')
+
+class _MappedStore:
+    """One opened store file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.map)
+        magic, version, _, self.quiz_count, self.max_id, count, max_id = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a compiled quiz store')
+        self.fingerprint = (count, max_id)
+
+    def quiz_offset(self, quiz_id):
+        if not 0 < quiz_id <= self.max_id:
+            return 0
+        return QUIZ_OFFSET.unpack_from(self.buf, HEADER.size + quiz_id * QUIZ_OFFSET.size)[0]
+
+    def get_quiz(self, quiz_id):
+        offset = self.quiz_offset(quiz_id)
+        if not offset:
+            return None
+        meta_len = U32.unpack_from(self.buf, offset)[0]
+        quiz = json.loads(bytes(self.buf[offset + 4:offset + 4 + meta_len]))
+        offset += 4 + meta_len
+        count = U32.unpack_from(self.buf, offset)[0]
+        quiz['questions'] = CompiledQuestions(self.buf, offset + 4, offset + 4 + count, count)
+        return quiz
+
+    def all_quiz_ids(self):
+        return [quiz_id for quiz_id in range(1, self.max_id + 1) if self.quiz_offset(quiz_id)]
+
+    def created_at(self, quiz_id):
+        """The stored quiz's created_at, or None if it isn't in this file"""
+        offset = self.quiz_offset(quiz_id)
+        if not offset:
+            return None
+        meta_len = U32.unpack_from(self.buf, offset)[0]
+        return json.loads(bytes(self.buf[offset + 4:offset + 4 + meta_len]))['created_at']
+
+    def copy_quiz(self, quiz_id, data):
+        """Append a quiz's compiled block to data, moving its record offsets to the new position"""
+        offset = self.quiz_offset(quiz_id)
+        meta_len = U32.unpack_from(self.buf, offset)[0]
+        count = U32.unpack_from(self.buf, offset + 4 + meta_len)[0]
+        table = offset + 4 + meta_len + 4 + count
+        records = list(struct.iter_unpack(RECORD.format, self.buf[table:table + RECORD.size * count]))
+        end = records[-1][0] + records[-1][1] if records else table
+
+        shift = len(data) - offset
+        data += self.buf[offset:end]
+        moved = struct.pack('<' + RECORD.format[1:] * count,
+                            *(value for record_offset, length in records for value in (record_offset + shift, length)))
+        data[table + shift:table + shift + len(moved)] = moved
+
+class QuizStore:
+    """Compiled quizzes shared by all workers through one memory-mapped file.
+
+    Quizzes (metadata, questions, pre-rendered HTML and answer key) are written
+    to an immutable, versioned file; a CURRENT file names the live version.
+    Every worker maps the same file, so the pages are shared through the OS
+    page cache instead of each worker holding decoded copies, and a fresh
+    worker is warm as soon as it maps it. Question q of quiz id is found via
+    two fixed-size offset tables. Workers notice a new version by checking
+    CURRENT at most every COMPILED_STORE_CHECK_SECONDS.
+    """
+
+    def __init__(self, app=None):
+        self._store = None
+        self._pointer_mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = str(app.config['COMPILED_DIR'])
+        self.check_interval = app.config['COMPILED_STORE_CHECK_SECONDS']
+        self.logger = app.logger
+        self.db = Database()
+
+        try:
+            self._refresh(force=True)
+            if self._store is None or self._store.fingerprint != store_fingerprint(self.db):
+                self.rebuild()
+        except Exception:
+            self.logger.exception('Could not load the compiled quiz store')
+
+    def rebuild(self, full=False):
+        """Write a new store version matching the database.
+
+        Quizzes never change once created, so those already compiled in the
+        current version (same id and created_at) are copied over as bytes and
+        only new quizzes are read and have their markdown rendered. full
+        recompiles everything, e.g. after a restore.
+        """
+        fingerprint = store_fingerprint(self.db)
+        versions = self.db.get_quiz_versions()
+        try:
+            self._refresh(force=True)
+        except (OSError, ValueError):
+            self.logger.exception('Could not load the compiled quiz store')
+        previous = None if full else self._store
+        copy_ids = [quiz_id for quiz_id, created_at in versions.items()
+                    if previous is not None and previous.created_at(quiz_id) == created_at]
+        copied = set(copy_ids)
+        quizzes = [self.db.get_quiz(quiz_id) for quiz_id in versions if quiz_id not in copied]
+        write_store(self.directory, [quiz for quiz in quizzes if quiz], fingerprint, previous, copy_ids)
+        self._refresh(force=True)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            pointer = os.path.join(self.directory, POINTER_FILE)
+            try:
+                mtime = os.stat(pointer).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self._pointer_mtime and self._store is not None:
+                return
+            with open(pointer) as f:
+                name = f.read().strip()
+            self._store = _MappedStore(os.path.join(self.directory, name))
+            self._pointer_mtime = mtime
+
+    def get_quiz(self, quiz_id):
+        """Quiz dict with lazily decoded questions, or None if not in the store"""
+        try:
+            self._refresh()
+        except (OSError, ValueError):
+            self.logger.exception('Could not refresh the compiled quiz store')
+        store = self._store
+        return store.get_quiz(quiz_id) if store else None
+
+    def get_all_quizzes(self):
+        """All compiled quizzes, newest first, or None if the store isn't available"""
+        try:
+            self._refresh()
+        except (OSError, ValueError):
+            self.logger.exception('Could not refresh the compiled quiz store')
+        store = self._store
+        if store is None:
+            return None
+        quizzes = [store.get_quiz(quiz_id) for quiz_id in store.all_quiz_ids()]
+        return sorted(quizzes, key=lambda q: (q['created_at'], q['id']), reverse=True)
@@ -0,0 +1,91 @@
+import random
+import secrets
+
+# Pool questions are fetched in chunks to stay under SQLite's variable limit
+FETCH_CHUNK = 500
+
+def new_seed():
+    """Random per-attempt seed (fits in a SQLite INTEGER)"""
+    return secrets.randbits(63)
+
+def _rng(seed, *salt):
+    # String seeds are hashed with SHA-512, so the stream is the same in every process
+    return random.Random(':'.join(str(part) for part in (seed,) + salt))
+
+def question_refs(quiz_data, seed):
+    """References to an attempt's questions, in quiz order.
+
+    Fixed quizzes yield indexes into quiz_data['questions']; pool quizzes yield
+    (pool_id, position) pairs, draw by draw. Each draw samples k of the pool's
+    N positions in O(k) time, so the layout is recomputed from the seed instead
+    of stored. A seed of None means no sampling.
+
+    Answers are stored in this order - answer i belongs to question i of a fixed
+    quiz however the questions were shown.
+    """
+    if not quiz_data['pool_draws']:
+        return list(range(len(quiz_data['questions'])))
+
+    refs = []
+    for i, draw in enumerate(quiz_data['pool_draws']):
+        if seed is None:
+            positions = range(draw['count'])
+        else:
+            positions = _rng(seed, 'pool', i).sample(range(draw['size']), draw['count'])
+        refs.extend((draw['pool_id'], position) for position in positions)
+    return refs
+
+def question_order(quiz_data, seed):
+    """Quiz-order index of the question shown at each position of an attempt"""
+    order = list(range(quiz_data['question_count']))
+    if quiz_data['shuffle_questions'] and seed is not None:
+        _rng(seed, 'order').shuffle(order)
+    return order
+
+def option_order(quiz_data, seed, index, option_count):
+    """Displayed-to-original option mapping for the question at index in an attempt"""
+    order = list(range(option_count))
+    if quiz_data['shuffle_options'] and seed is not None:
+        _rng(seed, 'options', index).shuffle(order)
+    return order
+
+def _fetch(db, quiz_data, refs):
+    """Resolve question references to question dicts, with indexed lookups for pools"""
+    if not quiz_data['pool_draws']:
+        return [quiz_data['questions'][ref] for ref in refs]
+
+    by_pool = {}
+    for pool_id, position in refs:
+        by_pool.setdefault(pool_id, []).append(position)
+
+    found = {}
+    for pool_id, positions in by_pool.items():
+        for start in range(0, len(positions), FETCH_CHUNK):
+            for position, question in db.get_pool_questions(pool_id, positions[start:start + FETCH_CHUNK]).items():
+                found[(pool_id, position)] = question
+    return [found[ref] for ref in refs]
+
+def attempt_questions(db, quiz_data, seed):
+    """All questions of an attempt in quiz order, with options in original order"""
+    return _fetch(db, quiz_data, question_refs(quiz_data, seed))
+
+def attempt_answer_key(db, quiz_data, seed):
+    """Correct option index of each of an attempt's questions, in quiz order"""
+    questions = quiz_data['questions']
+    if not quiz_data['pool_draws'] and hasattr(questions, 'answer_key'):
+        # Compiled quizzes: one byte per question, no question records decoded
+        return questions.answer_key().tolist()
+    return [question['correct'] for question in attempt_questions(db, quiz_data, seed)]
+
+def attempt_question(db, quiz_data, seed, index):
+    """The question shown at position index of an attempt, with options in original order"""
+    return _fetch(db, quiz_data, [question_refs(quiz_data, seed)[question_order(quiz_data, seed)[index]]])[0]
+
+def shuffle_options(question, order):
+    """Copy of question with options in display order and 'correct' pointing into them"""
+    shuffled = dict(question,
+                    options=[question['options'][i] for i in order],
+                    correct=order.index(question['correct']))
+    if 'options_html' in question:
+        shuffled['options_html'] = [question['options_html'][i] for i in order]
+    return shuffled
@@ -0,0 +1,40 @@
+import html
+import re
+
+# Snippet highlight markers - control characters never appear in stored text
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+# Matches ranked together. Terms with more matches are ranked newest batch
+# first, since ranking every match of a very common term costs hundreds of
+# milliseconds at hundreds of thousands of rows.
+SEARCH_CANDIDATES = 5000
+
+def fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, the last as a prefix"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def highlight_html(snippet):
+    """Escape a snippet and turn its match markers into <mark> tags"""
+    if not snippet:
+        return ''
+    return (html.escape(snippet)
+            .replace(MARK_START, '<mark>')
+            .replace(MARK_END, '</mark>'))
+
+def encode_cursor(rank, rowid, bound=None):
+    """Keyset pagination cursor for the row after (rank, rowid) in the candidate batch below bound"""
+    return f'{rank!r}:{rowid}:{"" if bound is None else bound}'
+
+def decode_cursor(cursor):
+    """Parse a cursor from encode_cursor into (rank, rowid, bound), or None if missing or malformed"""
+    try:
+        rank, rowid, bound = cursor.split(':')
+        return float(rank), int(rowid), int(bound) if bound else None
+    except (AttributeError, ValueError):
+        return None